@@ -0,0 +1,131 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from headless import Headless
+from cache import ProgramCache
+
+
+# -----------------------
+# Batch runner
+# -----------------------
+# Runs many programs across a process pool, one Headless session per program,
+# and streams one JSON object per program as each finishes. Programs run in
+# turbo mode under a statement and a wall-time limit; INPUT sees end of file.
+CHUNK = 10000   # statements per slice between limit checks
+
+_cache = None   # this worker's ProgramCache
+
+
+def run_one(path, engine='vm', max_statements=None, max_seconds=None, cache=None):
+    """Run one program; a dict with its output, final screen, error and stats."""
+    h = Headless('turbo', engine, cache=cache)
+    inter = h.inter
+    output = []
+
+    def sink(text):
+        output.append(text)
+        h.out_callback(text)
+    inter.out.sink = sink
+
+    result = {'path': path, 'status': 'ok', 'error': None}
+    start = time.perf_counter()
+    executed = 0
+    try:
+        h.load(path)
+        inter.input_line('RUN')
+        deadline = start + max_seconds if max_seconds is not None else None
+        while inter.running:
+            budget = CHUNK if max_statements is None else min(CHUNK, max_statements - executed)
+            if budget <= 0:
+                result['status'] = 'statement limit'
+                inter.stop()
+                break
+            inter.step(budget)
+            executed += budget - inter.left
+            inter.flush()
+            if deadline is not None and inter.running and time.perf_counter() > deadline:
+                result['status'] = 'time limit'
+                inter.stop()
+        inter.flush()
+        if inter.error:
+            result['status'] = 'error'
+            result['error'] = inter.error
+    except Exception as e:
+        # a program that doesn't load, or a blocking statement that failed
+        result['status'] = 'error'
+        result['error'] = f"{type(e).__name__}: {e}"
+    secs = time.perf_counter() - start
+    result['output'] = ''.join(output)
+    result['screen'] = h.screen_text()
+    result['stats'] = {
+        'statements': executed,
+        'seconds': secs,
+        'statements_per_sec': executed / secs if secs else 0.0,
+    }
+    return result
+
+
+def _init_worker(cache_dir):
+    global _cache
+    # INPUT reads stdin and prompts on stdout, which carries the results
+    sys.stdin = open(os.devnull)
+    sys.stdout = sys.stderr
+    if cache_dir is not None:
+        _cache = ProgramCache(cache_dir)
+
+
+def _run_job(job):
+    return run_one(*job, _cache)
+
+
+def run_batch(paths, engine='vm', max_statements=None, max_seconds=None, workers=None, ordered=False,
+              cache_dir=None):
+    """Yield run_one() results for paths, spread over workers processes (all cores by default).
+
+    With cache_dir, workers share a compile cache there."""
+    jobs = [(p, engine, max_statements, max_seconds) for p in paths]
+    with Pool(workers, _init_worker, (cache_dir,)) as pool:
+        results = pool.imap if ordered else pool.imap_unordered
+        yield from results(_run_job, jobs, chunksize=1)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Run many BASIC programs in parallel and write the results as JSONL.")
+    p.add_argument('programs', nargs='+', help="program files, or directories to take every *.bas from")
+    p.add_argument('--engine', choices=('vm', 'py', 'ref'), default='vm')
+    p.add_argument('--max-statements', type=int, help="stop each program after this many statements")
+    p.add_argument('--max-seconds', type=float, help="stop each program after this much wall time")
+    p.add_argument('-j', '--workers', type=int, help="worker processes (default: one per core)")
+    p.add_argument('--ordered', action='store_true', help="write results in input order, not as they finish")
+    p.add_argument('-o', '--output', metavar='FILE', help="write the JSONL here instead of stdout")
+    p.add_argument('--cache', metavar='DIR', help="compile cache shared by the workers and later runs")
+    args = p.parse_args(argv)
+
+    paths = []
+    for path in args.programs:
+        if os.path.isdir(path):
+            paths.extend(sorted(glob.glob(os.path.join(path, '*.bas'))))
+        else:
+            paths.append(path)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    failed = 0
+    try:
+        for result in run_batch(paths, args.engine, args.max_statements, args.max_seconds,
+                                args.workers, args.ordered, args.cache):
+            failed += result['status'] != 'ok'
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from interpreter import tokenize, to_rpn, eval_rpn, compile_rpn
+from variables import Variables
+from screen import Screen
+from raster import Rasteriser, load_glyphs
+from headless import Headless
+
+
+# -----------------------
+# Benchmarks
+# -----------------------
+# Whole programs from benchmarks/*.bas, run headless in turbo mode on each
+# engine, reported as statements/s; and micro-benchmarks of the pieces a
+# statement goes through, reported as ns/op. Results are JSON so runs on two
+# commits can be compared with --compare.
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+
+EXPR = 'A*2+B/(C-1)-INT(X*100)/100'
+LINE = 'FOR I=1 TO LEN(A$) STEP 2:B$=B$+MID$(A$,I,1):NEXT I'
+
+
+def run_program(path, engine):
+    """Run one program to the end; (statements executed, seconds)."""
+    h = Headless('turbo', engine)
+    h.load(path)
+    start = time.perf_counter()
+    h.run()
+    return h.inter.scheduler.executed, time.perf_counter() - start
+
+
+def bench_program(path, engine, repeat):
+    best = None
+    for _ in range(repeat):
+        stmts, secs = run_program(path, engine)
+        if best is None or secs < best[1]:
+            best = stmts, secs
+    stmts, secs = best
+    return {'statements': stmts, 'seconds': secs, 'statements_per_sec': stmts / secs}
+
+
+def timeit(fn, min_time=0.2):
+    """ns per call of fn(), best of three batches that each take about min_time."""
+    def batch(n):
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        return time.perf_counter() - start
+
+    n = 1
+    while (t := batch(n)) < min_time / 10:
+        n *= 10
+    n = max(int(n * min_time / t), 1)
+    return min(batch(n) for _ in range(3)) / n * 1e9
+
+
+def micro_benchmarks():
+    env = Variables()
+    for name, v in (('A', 3.0), ('B', 5.0), ('C', 2.0), ('X', 0.123456)):
+        env[name] = v
+    toks = tokenize(EXPR)
+    rpn = to_rpn(toks)
+    compiled = compile_rpn(rpn, env)
+
+    class App:
+        pass
+    screen = Screen(App())
+    text40 = 'HELLO WORLD ' * 3 + 'ABCD'
+    page = '\n'.join(f'LINE {i} OF A LONG LISTING' for i in range(100)) + '\n'
+    raster = Rasteriser(load_glyphs(os.path.join(os.path.dirname(CORPUS), 'res', 'glyph.png')))
+
+    def scroll_line():
+        screen.write(0, 24, text40 + '\n', False)
+
+    return {
+        'tokenize_expr': lambda: tokenize(EXPR),
+        'tokenize_line': lambda: tokenize(LINE),
+        'to_rpn': lambda: to_rpn(toks),
+        'eval_rpn': lambda: eval_rpn(rpn, env),
+        'compiled_expr': compiled,
+        'screen_write_line': lambda: screen.write(0, 10, text40, False),
+        'screen_write_scroll': scroll_line,
+        'screen_write_page': lambda: screen.write(0, 0, page, False),
+        'raster_frame': lambda: raster.draw(screen.screen, screen.cur_pos),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(CORPUS),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    """Lines of new/old speed ratios (>1 is faster) for everything in both."""
+    out = []
+    for name, engines in new['programs'].items():
+        for engine, r in engines.items():
+            o = old.get('programs', {}).get(name, {}).get(engine)
+            if o:
+                out.append(f"{name}/{engine:<4} {r['statements_per_sec'] / o['statements_per_sec']:6.2f}x")
+    for name, r in new['micro'].items():
+        o = old.get('micro', {}).get(name)
+        if o:
+            out.append(f"{name:<20} {o['ns_per_op'] / r['ns_per_op']:6.2f}x")
+    return out
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark the interpreter and the screen/raster path.")
+    p.add_argument('-k', metavar='PATTERN', default='', help="only benchmarks whose name contains PATTERN")
+    p.add_argument('--engine', choices=('vm', 'py', 'ref'), action='append', help="engines to run programs on (default all)")
+    p.add_argument('--repeat', type=int, default=3, help="runs per program, best is kept")
+    p.add_argument('--no-micro', action='store_true')
+    p.add_argument('--no-programs', action='store_true')
+    p.add_argument('-o', '--output', metavar='FILE', help="write the JSON here instead of stdout")
+    p.add_argument('--compare', metavar='FILE', help="print speedups against an earlier result")
+    args = p.parse_args(argv)
+
+    result = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'programs': {},
+        'micro': {},
+    }
+    if not args.no_programs:
+        for path in sorted(glob.glob(os.path.join(CORPUS, '*.bas'))):
+            name = os.path.splitext(os.path.basename(path))[0]
+            if args.k not in name:
+                continue
+            result['programs'][name] = {e: bench_program(path, e, args.repeat)
+                                        for e in args.engine or ('vm', 'py', 'ref')}
+    if not args.no_micro:
+        for name, fn in micro_benchmarks().items():
+            if args.k in name:
+                result['micro'][name] = {'ns_per_op': timeit(fn)}
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            for line in compare(json.load(f), result):
+                print(line, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
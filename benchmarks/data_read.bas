@@ -0,0 +1,14 @@
+10 REM DATA/READ: REREAD A TABLE WITH RESTORE
+20 T=0
+30 FOR N=1 TO 300
+40 RESTORE
+50 FOR I=1 TO 20
+60 READ V,W$
+70 T=T+V+LEN(W$)
+80 NEXT I
+90 NEXT N
+100 PRINT T
+110 DATA 1,"ONE",2,"TWO",3,"THREE",4,"FOUR",5,"FIVE"
+120 DATA 6,"SIX",7,"SEVEN",8,"EIGHT",9,"NINE",10,"TEN"
+130 DATA 11,"ELEVEN",12,"TWELVE",13,"THIRTEEN",14,"FOURTEEN",15,"FIFTEEN"
+140 DATA 16,"SIXTEEN",17,"SEVENTEEN",18,"EIGHTEEN",19,"NINETEEN",20,"TWENTY"
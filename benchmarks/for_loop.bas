@@ -0,0 +1,8 @@
+10 REM TIGHT NESTED FOR LOOPS
+20 S=0
+30 FOR I=1 TO 300
+40 FOR J=1 TO 100
+50 S=S+I*J
+60 NEXT J
+70 NEXT I
+80 PRINT S
@@ -0,0 +1,17 @@
+10 REM GOSUB-HEAVY: SMALL SUBROUTINES CALLED FROM A LOOP
+20 T=0
+30 FOR I=1 TO 5000
+40 GOSUB 200
+50 GOSUB 300
+60 NEXT I
+70 PRINT T
+80 END
+200 X=I-INT(I/7)*7
+210 GOSUB 400
+220 RETURN
+300 T=T+X
+310 RETURN
+400 IF X>3 THEN 420
+410 RETURN
+420 X=X-3
+430 RETURN
@@ -0,0 +1,4 @@
+10 REM PRINT-HEAVY: SCROLL THE SCREEN
+20 FOR I=1 TO 2000
+30 PRINT "LINE";I,"SQUARE";I*I
+40 NEXT I
@@ -0,0 +1,11 @@
+10 REM STRING BUILDING WITH MID$, LEFT$ AND RIGHT$
+20 A$="THE QUICK BROWN FOX JUMPS OVER THE LAZY DOG"
+30 FOR N=1 TO 200
+40 R$=""
+50 FOR I=LEN(A$) TO 1 STEP -1
+60 R$=R$+MID$(A$,I,1)
+70 NEXT I
+80 B$=LEFT$(R$,10)+RIGHT$(A$,10)
+90 NEXT N
+100 PRINT R$
+110 PRINT B$
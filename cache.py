@@ -0,0 +1,91 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+
+# -----------------------
+# Compile cache
+# -----------------------
+# The analysed form of a program (statement tokens, jump targets, the RPN of
+# every expression, the DATA table) pickled under the sha256 of its text, so
+# loading a program seen before skips the lexer and the parser. Entries are
+# files in one directory, which can be shared by processes; the least
+# recently used ones are deleted once they take more than max_bytes.
+CACHE_VERSION = 3   # part of every key: bump when tokens or RPN change shape, or to drop bad entries
+CACHE_DIR = os.environ.get('C64BASIC_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'c64basic'))
+
+
+def program_key(lines):
+    """Hash of a program given as sorted (lineno, text) pairs."""
+    h = hashlib.sha256(f"c64basic {CACHE_VERSION}\n".encode())
+    for lineno, text in lines:
+        h.update(f"{lineno} {text}\n".encode('utf-8', 'surrogatepass'))
+    return h.hexdigest()
+
+
+class ProgramCache:
+    def __init__(self, path=CACHE_DIR, max_bytes=64 << 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = None    # bytes in the directory, as far as this process knows
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.pkl')
+
+    def load(self, key):
+        """The entry stored under key, or None."""
+        path = self._file(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            return None     # half-written or from another version: treat as a miss
+        try:
+            os.utime(path)  # mtime is the LRU clock
+        except OSError:
+            pass
+        return entry
+
+    def store(self, key, entry):
+        data = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        # written aside and renamed, so readers never see part of an entry
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        if self.size is not None:
+            self.size += len(data)
+        if self.size is None or self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for e in os.scandir(self.path):
+            if e.name.endswith('.pkl'):
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue    # evicted by another process meanwhile
+                entries.append((st.st_mtime, st.st_size, e.path))
+        self.size = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.size -= size
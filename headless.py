@@ -0,0 +1,109 @@
+import argparse
+import os
+import sys
+
+from screen import Screen
+from interpreter import BasicInterpreter
+from raster import Rasteriser, load_glyphs, write_png
+from cache import ProgramCache
+
+
+# -----------------------
+# Headless runner
+# -----------------------
+# Drives BasicInterpreter and Screen the way Renderer does, minus pygame and
+# OpenGL. Frames advance a fixed dt, so 'authentic' runs are deterministic;
+# 'turbo' slices by wall time and only the end result is reproducible.
+class Headless:
+    def __init__(self, mode='turbo', engine='vm', fps=60.0, cache=None):
+        self.time = 0.0
+        self.dt = 1.0 / fps
+        self.frames = 0
+        self.screen = Screen(self)
+        self.inter = BasicInterpreter(self.out_callback, engine=engine, sliced=True, mode=mode,
+                                      memory=self.screen.memory, cache=cache)
+        self.raster = None
+
+    def out_callback(self, text):
+        self.screen.write(*self.screen.cur_pos, text, capture=False)
+
+    def load(self, path):
+        self.inter.load_file(path)
+
+    def run(self, max_frames=None, on_frame=None):
+        """RUN the program, calling on_frame(self) after every frame; BREAK after max_frames."""
+        self.inter.input_line('RUN')
+        while self.inter.running:
+            self.inter.scheduler.frame(self.inter, self.dt)
+            self.inter.flush()
+            self.time += self.dt
+            self.frames += 1
+            if on_frame is not None:
+                on_frame(self)
+            if max_frames is not None and self.frames >= max_frames:
+                self.inter.stop()
+
+    def frame(self):
+        """The current screen as an RGB array, like the display pass draws it."""
+        if self.raster is None:
+            self.raster = Rasteriser(load_glyphs())
+        cursor = self.screen.cur_pos if self.time % .5 < .25 else None
+        return self.raster.draw(self.screen.screen, cursor, self.screen.colour_screen)
+
+    def screen_codes(self):
+        """The 40x25 screen codes, row by row."""
+        return self.screen.screen.T.tobytes()
+
+    def screen_text(self):
+        """The screen as 25 lines of text, for snapshot tests."""
+        lines = []
+        for row in self.screen.screen.T:
+            lines.append(''.join(chr(c + 64) if 1 <= c <= 26 else chr(c) if 32 <= c < 64 else '?'
+                                 for c in row.tolist()).rstrip())
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Run a BASIC program without a window.")
+    p.add_argument('program')
+    p.add_argument('--mode', choices=('turbo', 'authentic'), default='turbo')
+    p.add_argument('--engine', choices=('vm', 'py', 'ref'), default='vm')
+    p.add_argument('--frames', type=int, help="stop the program after this many frames")
+    p.add_argument('--png', metavar='DIR', help="write every frame as DIR/frame_00000.png")
+    p.add_argument('--raw', metavar='FILE', help="append every frame to FILE as raw RGB")
+    p.add_argument('--final-png', metavar='FILE', help="write the last frame as a PNG")
+    p.add_argument('--screen', metavar='FILE', help="write the final 1000 screen codes to FILE")
+    p.add_argument('--quiet', action='store_true', help="don't print the final screen")
+    p.add_argument('--cache', metavar='DIR', help="keep analysed programs in DIR between runs")
+    args = p.parse_args(argv)
+
+    h = Headless(args.mode, args.engine, cache=ProgramCache(args.cache) if args.cache else None)
+    h.load(args.program)
+
+    raw = open(args.raw, 'wb') if args.raw else None
+    if args.png:
+        os.makedirs(args.png, exist_ok=True)
+
+    def on_frame(h):
+        if args.png:
+            write_png(os.path.join(args.png, f'frame_{h.frames:05d}.png'), h.frame())
+        if raw:
+            raw.write(h.frame().tobytes())
+
+    try:
+        h.run(args.frames, on_frame if (args.png or raw) else None)
+    finally:
+        if raw:
+            raw.close()
+    if args.final_png:
+        write_png(args.final_png, h.frame())
+    if args.screen:
+        with open(args.screen, 'wb') as f:
+            f.write(h.screen_codes())
+    if not args.quiet:
+        print(h.screen_text())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
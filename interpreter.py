@@ -2,6 +2,13 @@ import re
 import sys
 import math
 import random as rand
+import time
+from bisect import bisect_left
+from variables import Variables
+from scheduler import Scheduler
+from output import OutputBuffer
+from profiler import Profiler, stmt_kind
+from memory import Memory
 try:
     import readline
 except ImportError:
@@ -15,7 +22,7 @@ TOKEN_SPEC = [
     ('NUMBER',   r'\d+(\.\d*)?'),               # integer or decimal
     ('STRING',   r'"([^"]*)"'),                 # "string"
     ('BITWISE',  r'\b(?:AND|OR|NOT)\b'),        # bitwise operators
-    ('NAME',     r'[A-Za-z][A-Za-z0-9\$]*'),    # variable or keyword
+    ('NAME',     r'[A-Za-z][A-Za-z0-9]*[\$%]?'), # variable or keyword
     ('OP',       r'<=|>=|<>|[+\-*/\^=<>:;]'),   # operators, punctuation
     ('LPAREN',   r'\('),
     ('RPAREN',   r'\)'),
@@ -24,9 +31,14 @@ TOKEN_SPEC = [
     ('UNKNOWN',  r'.'),
 ]
 TOK_RE = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in TOKEN_SPEC))
+# Lines loaded from a PRG file (see prg.py) keep their keywords as single
+# characters \x80-\xcb, which lex straight to the keyword's tokens
+CRUNCHED_RE = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in TOKEN_SPEC[:-1])
+                         + '|(?P<KEYWORD>[\x80-\xcb])|(?P<UNKNOWN>.)')
 
 KEYWORDS = {'PRINT','LET','INPUT','GOTO','IF','THEN','FOR','TO','STEP','NEXT',
-            'GOSUB','RETURN','REM','END','STOP','DATA','READ','RESTORE','LIST','RUN','NEW'}
+            'GOSUB','RETURN','REM','END','STOP','DATA','READ','RESTORE','LIST','RUN','NEW',
+            'DIM','POKE'}
 
 FUNCS = { # Name, Number of args
     'ABS': 1,
@@ -54,12 +66,16 @@ FUNCS = { # Name, Number of args
     'RIGHT$':2
 }
 
-def tokenize(s):
-    """Convert a line of BASIC code into a list of tokens."""
+def tokenize(s, keywords=None):
+    """Convert a line of BASIC code into a list of tokens.
+
+    For a crunched line, keywords maps each keyword character to its tokens."""
     tokens = []
     pos = 0
+    rx = TOK_RE if keywords is None else CRUNCHED_RE
+    kw_end = -1     # where the last keyword character was
     while pos < len(s):
-        m = TOK_RE.match(s, pos)
+        m = rx.match(s, pos)
         if not m:
             break
         kind = m.lastgroup
@@ -76,7 +92,6 @@ def tokenize(s):
         elif kind == 'STRING':
             tokens.append(('STRING', m.groups()[3]))
         elif kind == 'BITWISE':
-            print(m.groups())
             tokens.append(('BITWISE', m.groups()[4]))
         elif kind == 'NAME':
             up = txt.upper()
@@ -88,15 +103,39 @@ def tokenize(s):
                 tokens.append(('NAME', up))
         elif kind in ('OP','LPAREN','RPAREN','COMMA'):
             tokens.append((kind, txt))
+        elif kind == 'KEYWORD':
+            new = keywords[txt]
+            op = tokens[-1][1] + new[0][1] if m.start() == kw_end and tokens[-1][0] == 'OP' else None
+            if op in ('<=', '>=', '<>'):
+                tokens[-1] = ('OP', op)     # crunched as two keywords
+            else:
+                tokens.extend(new)
+            kw_end = pos
         else:
             tokens.append(('UNKNOWN', txt))
     return tokens
 
 
+def split_statements(tokens):
+    """Split a tokenized line into statements on ':' (REM swallows the rest)."""
+    stmts = []
+    cur = []
+    for t in tokens:
+        if t == ('OP', ':'):
+            if cur: stmts.append(cur)
+            cur = []
+            continue
+        cur.append(t)
+        if t[0] == 'REM' and len(cur) == 1:
+            break
+    if cur: stmts.append(cur)
+    return stmts
+
+
 # -----------------------
 # Expression parser: Shunting-Yard -> RPN
 # -----------------------
-PREC = {'^': 5, '*': 4, '/': 4, '+': 3, '-': 3,
+PREC = {'^': 5, 'NEG': 4.5, '*': 4, '/': 4, '+': 3, '-': 3,
         'AND': 2, 'OR': 2, 'NOT': 2,
         '=': 1, '<': 1, '>': 1, '<=':1, '>=':1, '<>':1}
 
@@ -106,26 +145,36 @@ def to_rpn(tokens):
     """Convert token list to RPN using shunting-yard algorithm."""
     out = []
     stack = []
-    #print(tokens)
+    argc = []   # arguments seen inside each open parenthesis
+    prev = None
     
-    for t in tokens:
+    for i, t in enumerate(tokens):
         typ, val = t
-        #print(f"T: {t}\t\t|| Stack: {stack} || Output: {out}")
-        if typ in ('NUMBER','STRING','NAME'):
+        if typ == 'NAME' and i+1 < len(tokens) and tokens[i+1][0] == 'LPAREN':
+            stack.append(('ARRAY', val))  # subscripted variable, reduced like a function
+        elif typ in ('NUMBER','STRING','NAME'):
             out.append(t)
         elif typ == 'FUNC':
             stack.append(t)  # function will be handled as operator with args
         elif typ == 'LPAREN':
             stack.append(t)
+            argc.append(1)
         elif typ == 'RPAREN':
             while stack and stack[-1][0] != 'LPAREN':
                 out.append(stack.pop())
             if not stack:
                 raise SyntaxError("Mismatched parentheses")
             stack.pop()  # remove LPAREN
+            n = argc.pop()
             # If a function is on top, pop it to output
             if stack and stack[-1][0] == 'FUNC':
                 out.append(stack.pop())
+            elif stack and stack[-1][0] == 'ARRAY':
+                out.append(('ARRAY', (stack.pop()[1], n)))
+        elif typ == 'OP' and val in ('-', '+') and (prev is None or prev[0] in ('OP','LPAREN','COMMA','BITWISE')):
+            # unary sign: a prefix operator, so nothing is popped for it
+            if val == '-':
+                stack.append(('OP', 'NEG'))
         elif typ == 'OP':
             while stack and stack[-1][0] == 'OP':
                 o2 = stack[-1][1]
@@ -139,9 +188,14 @@ def to_rpn(tokens):
                 out.append(stack.pop())
             stack.append(t)
         elif typ == 'COMMA':
-            stack.append(t)
+            # argument separator: finish the argument before it
+            while stack and stack[-1][0] != 'LPAREN':
+                out.append(stack.pop())
+            if argc:
+                argc[-1] += 1
         else:
             raise RuntimeError(f"Unknown token type: {typ}")
+        prev = t
     
     while stack:
         if stack[-1][0] in ('LPAREN','RPAREN'):
@@ -154,7 +208,6 @@ def to_rpn(tokens):
 def eval_rpn(rpn, env):
     """Evaluate an RPN expression with given environment."""
     st = []
-    print(rpn)
     for typ, val in rpn:
         if typ == 'NUMBER' or typ == 'STRING':
             st.append(val)
@@ -164,10 +217,17 @@ def eval_rpn(rpn, env):
             # Very simple single-arg function evaluation
             arg = [st.pop() for _ in range(FUNCS[val])]
             arg.reverse()
-            st.append(eval_func(val, *arg))
+            if val == 'PEEK':
+                st.append(env.memory.peek(arg[0]))
+            else:
+                st.append(eval_func(val, *arg))
+        elif typ == 'ARRAY':
+            name, n = val
+            subs = st[len(st)-n:]
+            del st[len(st)-n:]
+            st.append(env.get_elem(name, subs))
         elif typ == 'OP':
-            print(st)
-            if val == '-' and len(st)<=2:
+            if val == 'NEG':
                 st.append(-st.pop())
                 continue
             b, a = st.pop(), st.pop()
@@ -184,7 +244,6 @@ def eval_rpn(rpn, env):
             elif val == '<>': st.append(1.0 if a!=b else 0.0)
             else: raise RuntimeError(f"Unknown operator: {val}")
         elif typ == 'BITWISE':
-            print(st)
             if val!='NOT': b = st.pop()
             a = st.pop()
             if val == 'AND': st.append(int(a and b))
@@ -195,51 +254,324 @@ def eval_rpn(rpn, env):
     return st[-1] if st else 0.0
 
 
+FUNC_TABLE = {
+    'ABS': abs,
+    'ATN': math.atan,
+    'COS': math.cos,
+    'EXP': math.exp,
+    'INT': math.floor,
+    'LOG': math.log,
+    'SGN': lambda x: x/abs(x) if x!=0 else 0,
+    'SIN': math.sin,
+    'SQR': math.sqrt,
+    'TAN': math.tan,
+    'RND': lambda x: rand.random(),
+    'SPC': lambda n: ' '*int(n),
+    'CHR$': lambda n: chr(int(n)),
+    'STR$': str,
+    'ASC': ord,
+    'LEN': len,
+    'VAL': float,
+    'LEFT$': lambda s, n: s[:int(n)],
+    'RIGHT$': lambda s, n: s[len(s)-int(n):],
+    'MID$': lambda s, i, n: s[int(i)-1:int(i)-1+int(n)],
+}
+
 def eval_func(name, *args):
     """Evaluate a BASIC function."""
-    name = name.upper()
+    f = FUNC_TABLE.get(name.upper())
+    if f is None:
+        return None
     try:
-        if name == 'ABS': return abs(args[0])
-        if name == 'ATN': return math.atan(args[0])
-        if name == 'COS': return math.cos(args[0])
-        if name == 'EXP': return math.exp(args[0])
-        if name == 'INT': return int(args[0])
-        if name == 'LOG': return math.log(args[0])
-        if name == 'SGN': return args[0]/abs(args[0]) if args[0]!=0 else 0
-        if name == 'SIN': return math.sin(args[0])
-        if name == 'SQR': return args[0]**2
-        if name == 'TAN': return math.tan(args[0])
-        if name == 'RND': return rand.random()
-        if name == 'SPC': return ' '*int(args[0])
-        if name == 'CHR$': return chr(int(args[0]))
-        if name == 'STR$': return str(args[0])
-        if name == 'ASC': return ord(args[0])
-        if name == 'LEN': return len(args[0])
-        if name == 'VAL': return float(args[0])
-        if name == 'LEFT$': return args[0][:args[1]]
-        if name == 'RIGHT$': return args[0][-args[1]:]
-        if name == 'MID$': return args[0][args[1]:args[1]+args[2]]
+        return f(*args)
     except Exception:
         return 0
 
 
+# -----------------------
+# Expression compiler: RPN -> closures
+# -----------------------
+# Each node is a zero-argument closure; operators and functions are bound
+# once here instead of being looked up by name on every evaluation.
+BINOPS = {
+    '+': lambda a, b: lambda: a() + b(),
+    '-': lambda a, b: lambda: a() - b(),
+    '*': lambda a, b: lambda: a() * b(),
+    '/': lambda a, b: lambda: a() / b(),
+    '^': lambda a, b: lambda: a() ** b(),
+    '=': lambda a, b: lambda: 1.0 if a() == b() else 0.0,
+    '<': lambda a, b: lambda: 1.0 if a() < b() else 0.0,
+    '>': lambda a, b: lambda: 1.0 if a() > b() else 0.0,
+    '<=': lambda a, b: lambda: 1.0 if a() <= b() else 0.0,
+    '>=': lambda a, b: lambda: 1.0 if a() >= b() else 0.0,
+    '<>': lambda a, b: lambda: 1.0 if a() != b() else 0.0,
+    'AND': lambda a, b: lambda: int(a() and b()),
+    'OR': lambda a, b: lambda: int(a() or b()),
+}
+UNOPS = {
+    'NEG': lambda a: lambda: -a(),
+    'NOT': lambda a: lambda: int(not a()),
+}
+
+def _const(v):
+    return lambda: v
+
+def _var(name, env):
+    if isinstance(env, Variables):
+        # resolved to a slot once; reads index the typed store directly
+        kind, i = env.slot(name)
+        store = env.stores[kind]
+        return lambda: store[i]
+    default = "" if name.endswith('$') or name == 'SPC' else 0.0
+    get = env.get
+    return lambda: get(name, default)
+
+def _elem(name, subs, env):
+    get_elem = env.get_elem
+    if len(subs) == 1:
+        s, = subs
+        arrays = env.arrays
+        def elem1():
+            k = s()
+            arr = arrays.get(name)
+            if arr is not None and arr.ndim == 1 and 0 <= k < arr.shape[0]:
+                return arr.item(int(k))
+            return get_elem(name, (k,))   # auto-DIM, BAD SUBSCRIPT
+        return elem1
+    return lambda: get_elem(name, [f() for f in subs])
+
+def _call(name, args):
+    f = FUNC_TABLE.get(name)
+    if f is None:
+        return _const(None)
+    if len(args) == 1:
+        x, = args
+        def call1():
+            v = x()
+            try:
+                return f(v)
+            except Exception:
+                return 0
+        return call1
+    def call():
+        vs = [a() for a in args]
+        try:
+            return f(*vs)
+        except Exception:
+            return 0
+    return call
+
+def _peek(addr, env):
+    # errors aren't swallowed like other functions': PEEK(-1) is ILLEGAL QUANTITY
+    peek = env.memory.peek
+    return lambda: peek(addr())
+
+def compile_rpn(rpn, env):
+    """Compile an RPN expression once into a closure that evaluates it against env."""
+    st = []     # (closure, is_constant)
+    for typ, val in rpn:
+        if typ == 'NUMBER' or typ == 'STRING':
+            st.append((_const(val), True))
+        elif typ == 'NAME':
+            st.append((_var(val, env), False))
+        elif typ == 'FUNC':
+            n = FUNCS[val]
+            args = [st.pop()[0] for _ in range(n)]
+            args.reverse()
+            st.append((_peek(args[0], env) if val == 'PEEK' else _call(val, args), False))
+        elif typ == 'ARRAY':
+            name, n = val
+            subs = [st.pop()[0] for _ in range(n)]
+            subs.reverse()
+            st.append((_elem(name, subs, env), False))
+        elif typ == 'COMMA':
+            continue
+        else:
+            if val in UNOPS:
+                a, const = st.pop()
+                fn = UNOPS[val](a)
+            else:
+                (b, bc), (a, ac) = st.pop(), st.pop()
+                if val not in BINOPS:
+                    raise RuntimeError(f"Unknown operator: {val}")
+                fn, const = BINOPS[val](a, b), ac and bc
+            if const:
+                # fold constant subexpressions; leave errors (1/0) for run time
+                try:
+                    fn = _const(fn())
+                except Exception:
+                    const = False
+            st.append((fn, const))
+    return st[-1][0] if st else _const(0.0)
+
+
+def split_args(toks):
+    """Split a token list on the commas that are not inside parentheses."""
+    args, cur, depth = [], [], 0
+    for t in toks:
+        if t[0] == 'LPAREN':
+            depth += 1
+        elif t[0] == 'RPAREN':
+            depth -= 1
+        elif t[0] == 'COMMA' and depth == 0:
+            args.append(cur); cur = []
+            continue
+        cur.append(t)
+    args.append(cur)
+    return args
+
+
+def parse_lvalue(toks):
+    """Read NAME or NAME(subscripts) off the front of toks: (name, subscript token lists or None, length)."""
+    name = toks[0][1]
+    if len(toks) < 2 or toks[1][0] != 'LPAREN':
+        return name, None, 1
+    depth = 0
+    for j in range(1, len(toks)):
+        if toks[j][0] == 'LPAREN':
+            depth += 1
+        elif toks[j][0] == 'RPAREN':
+            depth -= 1
+            if depth == 0:
+                return name, split_args(toks[2:j]), j+1
+    raise SyntaxError("Mismatched parentheses")
+
+
+def jump_targets(toks):
+    """Line numbers a statement can jump to (GOTO, GOSUB, IF ... THEN n)."""
+    if not toks:
+        return []
+    if toks[0][0] in ('GOTO', 'GOSUB'):
+        return [int(toks[1][1])] if len(toks) > 1 and toks[1][0] == 'NUMBER' else []
+    if toks[0][0] == 'IF':
+        kinds = [t[0] for t in toks]
+        if 'THEN' in kinds:
+            rest = toks[kinds.index('THEN')+1:]
+            if len(rest) == 1 and rest[0][0] == 'NUMBER':
+                return [int(rest[0][1])]
+            return jump_targets(rest)
+    return []
+
+
+def parse_print(toks):
+    """PRINT arguments as a list of RPN items and None for each ',' (next tab zone),
+    plus whether a newline follows (no trailing ';' or ',')."""
+    items = []
+    sub = []
+    depth = 0
+    newline = True
+    for t in toks:
+        if depth == 0 and (t == ('OP', ';') or t[0] == 'COMMA'):
+            if sub:
+                items.append(to_rpn(sub))
+                sub = []
+            if t[0] == 'COMMA':
+                items.append(None)
+            newline = False
+            continue
+        if sub and depth == 0 and (t[0] == 'STRING' or sub[-1][0] == 'STRING') \
+                and t[0] not in ('OP', 'BITWISE', 'RPAREN') and sub[-1][0] not in ('OP', 'BITWISE', 'LPAREN'):
+            # PRINT "X="X: a string next to a value is a separate item
+            items.append(to_rpn(sub))
+            sub = []
+        if t[0] == 'LPAREN':
+            depth += 1
+        elif t[0] == 'RPAREN':
+            depth -= 1
+        sub.append(t)
+        newline = True
+    if sub:
+        items.append(to_rpn(sub))
+    return items, newline
+
+
 # -----------------------
 # Program storage and interpreter
 # -----------------------
+class ProgramLine:
+    """A stored program line: the raw text plus its statements, tokenized once on entry."""
+    __slots__ = ('text', 'stmts', 'targets', 'cache', 'parsed')
+
+    def __init__(self, text, tokens=None):
+        self.text = text
+        self.stmts = split_statements(tokenize(text) if tokens is None else tokens)
+        self.targets = [n for toks in self.stmts for n in jump_targets(toks)]
+        self.cache = {}     # compiled expressions; replaced along with the line on edit
+        self.parsed = {}    # their RPN (or parse_print result), under the same keys; picklable
+
+    @classmethod
+    def restore(cls, text, stmts, targets, parsed):
+        """A line rebuilt from a compile cache entry, without lexing or parsing."""
+        line = cls.__new__(cls)
+        line.text, line.stmts, line.targets, line.parsed = text, stmts, targets, parsed
+        line.cache = {}
+        return line
+
+    def expr(self, toks, env):
+        """Compiled closure for an expression on this line, built on first use."""
+        key = tuple(toks)
+        fn = self.cache.get(key)
+        if fn is None:
+            rpn = self.parsed.get(key)
+            if rpn is None:
+                rpn = self.parsed[key] = to_rpn(toks)
+            fn = self.cache[key] = compile_rpn(rpn, env)
+        return fn
+
+    def print_items(self, toks, env):
+        """Compiled PRINT arguments (None for a tab) and the newline flag, built on first use."""
+        key = ('PRINT',) + tuple(toks)
+        hit = self.cache.get(key)
+        if hit is None:
+            parsed = self.parsed.get(key)
+            if parsed is None:
+                parsed = self.parsed[key] = parse_print(toks)
+            items, newline = parsed
+            hit = self.cache[key] = ([None if rpn is None else compile_rpn(rpn, env) for rpn in items], newline)
+        return hit
+
+
 class BasicInterpreter:
-    def __init__(self, output_callback):
+    def __init__(self, output_callback, engine='vm', sliced=False, mode='turbo', memory=None, cache=None):
         self.output_callback = output_callback
-        self.program = {}   # lineno -> raw line string
+        self.out = OutputBuffer(output_callback)   # drained by flush()
+        self.engine = engine    # 'vm' (bytecode), 'py' (transpiled) or 'ref' (line-by-line reference)
+        self.run_engine = engine    # engine of the current run
+        self.sliced = sliced    # RUN only starts the program; the host drives it with step()
+        self.scheduler = Scheduler(mode)    # 'authentic' (1 MHz C64 pace) or 'turbo'
+        self.program = {}   # lineno -> ProgramLine
         self.lines_sorted = []
-        self.vars = {}      # variable storage (strings if name ends with $)
+        self.line_numbers = []  # sorted line numbers, parallel to lines_sorted
+        self.line_index = {}    # lineno -> index into lines_sorted (None until rebuilt)
+        self.cache = cache      # ProgramCache for analysed programs, or None
+        self.cache_key = None   # key the program is cached under; None once it's edited
+        self.from_prg = False   # some lines were lexed from PRG bytes, not their text: never stored
+        self.data_table = None  # DATA items of the program, collected by the first RUN after an edit
+        self.vars = Variables()     # slot-based variable storage
+        self.memory = memory if memory is not None else Memory()  # shared with the Screen, if any
+        self.memory.sync = self.flush   # PRINTs land before a POKE to screen RAM
+        self.vars.memory = self.memory
         self.for_stack = [] # stack of (var, end, step, return_line)
         self.gosub_stack = []
         self.data = []
         self.data_ptr = 0
         self.pc_index = 0   # index into lines_sorted
+        self.jumped = False     # the line being run moved pc_index (ref engine)
+        self.cur_line = None    # ProgramLine being executed (holds its compiled expressions)
         self.running = False
+        self.vm = None      # VM (vm engine) or PyProgram (py engine) of the current run
+        self.left = 0       # budget left over by the last slice (negative when overrun)
+        self.profiler = None    # Profiler of the last run, if it was under PROFILE
+        self.profile_path = None    # where its collapsed stacks go, if anywhere
+        self.error = None   # message of the error that stopped the last run
 
     def input_line(self, line):
+        try:
+            self._input_line(line)
+        finally:
+            self.flush()
+
+    def _input_line(self, line):
         line = line.rstrip()
         if not line:
             return
@@ -248,12 +580,9 @@ class BasicInterpreter:
             lineno = int(m.group(1))
             rest = m.group(2)
             if rest.strip() == '':
-                # delete line
-                if lineno in self.program:
-                    del self.program[lineno]
+                self._delete_line(lineno)
             else:
-                self.program[lineno] = rest
-            self._refresh_lines()
+                self._store_line(lineno, ProgramLine(rest))
         else:
             # immediate command
             cmd = line.strip().upper()
@@ -261,52 +590,308 @@ class BasicInterpreter:
                 self.do_LIST()
             elif cmd == 'RUN':
                 self.do_RUN()
+            elif re.match(r'^PROFILE\s*("[^"]*")?$', cmd):
+                # PROFILE or PROFILE "stacks.txt": RUN, then report the hot lines
+                path = line.strip()[7:].strip()
+                self.do_RUN(profile=True, path=path[1:-1] or None)
+            elif re.match(r'^(SAVE|LOAD)\s*"[^"]*"(\s*,\s*\d+)*$', cmd):
+                # SAVE "NAME" / LOAD "NAME",8: a .prg file in the current directory
+                name = line.split('"')[1]
+                if cmd.startswith('SAVE'):
+                    self.do_SAVE(name)
+                else:
+                    self.do_LOAD(name)
             elif cmd == 'NEW':
                 self.program.clear(); self._refresh_lines()
-                self.output_callback("PROGRAM CLEARED.")
+                self.from_prg = False
+                self.out.line("PROGRAM CLEARED.")
             else:
                 # try to run as immediate statement (like PRINT "HI")
                 self.execute_statement_line('0', line, immediate=True)
 
+    def load_program(self, lines, merge=False):
+        """Enter many numbered lines at once, sorting and indexing them a single time."""
+        if not merge:
+            self.program.clear()
+            self.from_prg = False
+        entered = []
+        for line in lines:
+            line = line.rstrip()
+            if not line.strip():
+                continue
+            m = re.match(r'^\s*(\d+)\s*(.*)$', line)
+            if not m:
+                raise SyntaxError(f"MISSING LINE NUMBER: {line}")
+            entered.append((int(m.group(1)), m.group(2)))
+        if self.cache is not None and not merge and self._load_cached(entered):
+            return
+        for lineno, rest in entered:
+            if rest.strip() == '':
+                self.program.pop(lineno, None)
+            else:
+                self.program[lineno] = ProgramLine(rest)
+        self._refresh_lines()
+
+    def _load_cached(self, entered):
+        from cache import program_key
+        texts = {}
+        for lineno, rest in entered:
+            if rest.strip() == '':
+                texts.pop(lineno, None)
+            else:
+                texts[lineno] = rest
+        key = program_key(sorted(texts.items()))
+        entry = self.cache.load(key)
+        if entry is None:
+            return False
+        for lineno, text, stmts, targets, parsed in entry['lines']:
+            self.program[lineno] = ProgramLine.restore(text, stmts, targets, parsed)
+        self._refresh_lines()
+        self.data_table = entry['data']
+        self.cache_key = key
+        return True
+
+    def _store_cached(self):
+        from cache import program_key
+        key = program_key([(n, line.text) for n, line in self.lines_sorted])
+        entry = {
+            'lines': [(n, line.text, line.stmts, line.targets, line.parsed) for n, line in self.lines_sorted],
+            'data': self.data_table,
+        }
+        try:
+            self.cache.store(key, entry)
+        except OSError:
+            return  # a full or read-only cache only costs speed
+        self.cache_key = key
+
+    def load_file(self, path, merge=False):
+        if path.lower().endswith('.prg'):
+            self.load_prg(path, merge)
+            return
+        with open(path) as f:
+            self.load_program(f, merge)
+
+    def load_prg(self, path, merge=False):
+        """Load a tokenized C64 program; its lines are lexed from the token bytes."""
+        from prg import read_prg    # prg builds on this module
+        lines = read_prg(path)
+        if not merge:
+            self.program.clear()
+        for lineno, text, toks in lines:
+            self.program[lineno] = ProgramLine(text, toks)
+        self._refresh_lines()
+        self.from_prg = True
+
+    def save_prg(self, path):
+        from prg import write_prg
+        write_prg(path, [(n, line.text) for n, line in self.lines_sorted])
+
+    def _store_line(self, lineno, line):
+        self.cache_key = self.data_table = None
+        if lineno in self.program:
+            # replacing keeps the ordering and the index
+            self.lines_sorted[bisect_left(self.line_numbers, lineno)] = (lineno, line)
+        else:
+            i = bisect_left(self.line_numbers, lineno)
+            self.line_numbers.insert(i, lineno)
+            self.lines_sorted.insert(i, (lineno, line))
+            if i == len(self.line_numbers) - 1 and self.line_index is not None:
+                self.line_index[lineno] = i     # appended in order: index stays valid
+            else:
+                self.line_index = None
+        self.program[lineno] = line
+
+    def _delete_line(self, lineno):
+        if lineno not in self.program:
+            return
+        self.cache_key = self.data_table = None
+        del self.program[lineno]
+        i = bisect_left(self.line_numbers, lineno)
+        del self.line_numbers[i]
+        del self.lines_sorted[i]
+        self.line_index = None
+
     def _refresh_lines(self):
+        self.cache_key = self.data_table = None
         self.lines_sorted = sorted(self.program.items())
+        self.line_numbers = [n for n, _ in self.lines_sorted]
+        self.line_index = None
+
+    def _get_line_index(self):
+        # rebuilt lazily: inserts in the middle shift every later index
+        if self.line_index is None:
+            self.line_index = {n: i for i, n in enumerate(self.line_numbers)}
+        return self.line_index
     
     def do_LIST(self):
-        for n,txt in self.lines_sorted:
-            self.output_callback(f"{n} {txt}")
+        for n,line in self.lines_sorted:
+            self.out.line(f"{n} {line.text}")
+
+    def _prg_path(self, name):
+        return name if '.' in name else name + '.prg'
+
+    def do_SAVE(self, name):
+        if not name:
+            self.out.line("?MISSING FILE NAME ERROR")
+            return
+        self.out.line(f"SAVING {name.upper()}")
+        try:
+            self.save_prg(self._prg_path(name))
+        except OSError:
+            self.out.line("?DEVICE NOT PRESENT ERROR")
+        except ValueError:
+            self.out.line("?OUT OF MEMORY ERROR")
 
-    def do_RUN(self):
+    def do_LOAD(self, name):
+        self.out.line(f"SEARCHING FOR {name.upper()}")
+        try:
+            self.load_prg(self._prg_path(name))
+        except FileNotFoundError:
+            self.out.line("?FILE NOT FOUND ERROR")
+            return
+        except (OSError, ValueError):
+            self.out.line("?LOAD ERROR")
+            return
+        self.out.line("LOADING")
+
+    def do_RUN(self, profile=False, path=None, engine=None):
+        """RUN the program; engine overrides self.engine for this run."""
+        self.profiler = None
+        self.error = None
         if not self.lines_sorted:
-            self.output_callback("NO PROGRAM.")
+            self.out.line("NO PROGRAM.")
+            return
+        if not self._check_targets():
             return
         self.vars.clear()
         self.for_stack.clear()
         self.gosub_stack.clear()
         self.data_ptr = 0
-        self.data = self._collect_data()
+        if self.data_table is None:
+            self.data_table = self._collect_data()
+        self.data = self.data_table
         self.pc_index = 0
         self.running = True
-        #try:
+        self.scheduler.reset()
+        engine = engine or self.engine
+        if profile and engine == 'py':
+            engine = 'vm'   # generated code can't be timed statement by statement
+        self.run_engine = engine
+        if engine == 'vm':
+            from vm import compile_program, VM  # vm builds on this module
+            self.vm = VM(self, compile_program(self))
+        elif engine == 'py':
+            from transpile import transpile
+            self.vm = transpile(self)
+        if self.cache is not None and self.cache_key is None and engine != 'ref' and not self.from_prg:
+            # after compiling, so every expression's RPN goes in; the ref
+            # engine parses as it goes and would store a half-empty entry.
+            # Keys hash the text alone, so lines whose tokens came from PRG
+            # bytes must not answer for a program entered as text
+            self._store_cached()
+        if profile:
+            # gosub_stack holds return points; the GOSUB is just before each
+            if engine == 'vm':
+                lines = self.vm.program.lines
+                self.profiler = Profiler(lambda r: lines[r - 1])
+            else:
+                self.profiler = Profiler(lambda r: self.lines_sorted[r - 1][0])
+            self.profile_path = path
+        if not self.sliced:
+            try:
+                self.scheduler.run(self)
+            finally:
+                self._end_profile()
+
+    def profile(self, path=None):
+        """RUN under the profiler and return it; the report is printed when the program stops."""
+        self.do_RUN(profile=True, path=path)
+        return self.profiler
+
+    def _end_profile(self):
+        prof = self.profiler
+        if prof is None:
+            return
+        for row in prof.hot_lines():
+            self.out.line(row)
+        self.out.newline()
+        for row in prof.hot_kinds():
+            self.out.line(row)
+        if self.profile_path:
+            prof.write_collapsed(self.profile_path)
+
+    def _run(self, budget):
+        if self.run_engine != 'ref':
+            try:
+                if self.profiler is not None:
+                    return self.vm.profile(budget, self.profiler)
+                return self.vm.run(budget)
+            finally:
+                self.left = self.vm.left
+        return self._run_ref(budget)
+
+    def step(self, budget):
+        """Run the current program for about budget scheduler units; False once it has stopped."""
+        if not self.running:
+            return False
+        try:
+            more = self._run(budget)
+        except Exception as e:
+            self.running = False
+            self.error = f"?{str(e).upper()} ERROR IN {self._current_lineno()}"
+            self.out.line(self.error)
+            more = False
+        if not more:
+            self._end_profile()
+        return more
+
+    def stop(self):
+        """RUN/STOP: break into the running program."""
+        if self.running:
+            self.running = False
+            self.out.line(f"BREAK IN {self._current_lineno()}")
+            self._end_profile()
+
+    def _current_lineno(self):
+        if self.run_engine != 'ref':
+            return self.vm.lineno()
+        return self.line_numbers[min(self.pc_index, len(self.line_numbers) - 1)]
+
+    def _run_ref(self, budget=None):
+        cost = self.scheduler.cost
+        prof = self.profiler
+        self.left = budget if budget is not None else 1 << 62
         while self.running and 0 <= self.pc_index < len(self.lines_sorted):
+            if self.left <= 0:
+                return True
             lineno, line = self.lines_sorted[self.pc_index]
+            self.left -= sum(cost(toks) for toks in line.stmts)
+            self.jumped = False
             # execute
-            self.execute_statement_line(lineno, line)
-            # pc_index is updated by statements (GOTO etc). If not changed, move to next
-            if self.running and self.pc_index < len(self.lines_sorted) and (self.lines_sorted[self.pc_index][0] == lineno):
+            if prof is None:
+                self.execute_statement_line(lineno, line)
+            else:
+                stack = tuple(self.gosub_stack)
+                t = time.perf_counter()
+                try:
+                    self.execute_statement_line(lineno, line)
+                finally:
+                    prof.add(lineno, stmt_kind(line.stmts[0]), time.perf_counter() - t, stack)
+            # pc_index is updated by statements (GOTO etc). If they didn't, move to next;
+            # a jump to this very line leaves it where it was
+            if self.running and not self.jumped:
                 self.pc_index += 1
-        # except Exception as e:
-        #     self.output_callback("ERROR:", e)
-        #     self.running = False
+        self.running = False
+        return False
 
     def _collect_data(self):
         data = []
         for _,line in self.lines_sorted:
-            toks = tokenize(line)
-            if toks and toks[0][0] == 'DATA':
+            if line.stmts and line.stmts[0][0][0] == 'DATA':
                 # everything after DATA tokens split by commas and strings become data entries
-                after = line.upper().split('DATA',1)[1]
+                after = line.text.upper().split('DATA',1)[1]
                 # parse tokens simply: strings and numbers separated by commas
-                parts = re.findall(r'"([^"]*)"|[^,]+', after)
+                parts = [m.group(0) for m in re.finditer(r'"[^"]*"|[^,]+', after)]
                 for p in parts:
                     if p is None: continue
                     p = p.strip()
@@ -322,38 +907,35 @@ class BasicInterpreter:
 
     # Execute a single full line (may contain multiple statements separated by :)
     def execute_statement_line(self, lineno, line, immediate=False):
-        # split statements by colon (but avoid colon in strings)
-        parts = []
-        cur = ''
-        in_str = False
-        for ch in line:
-            if ch == '"':
-                in_str = not in_str
-                cur += ch
-            elif ch == ':' and not in_str:
-                parts.append(cur.strip()); cur = ''
-            else:
-                cur += ch
-        if cur.strip(): parts.append(cur.strip())
-        for stmt in parts:
+        # stored lines come pre-split; immediate input is tokenized here
+        if not isinstance(line, ProgramLine):
+            line = ProgramLine(line)
+        self.cur_line = line
+        for toks in line.stmts:
             if immediate:
-                self._exec_stmt(stmt, None)
+                self._exec_stmt(toks, None)
             else:
-                self._exec_stmt(stmt, lineno)
+                self._exec_stmt(toks, lineno)
+
+    def _check_targets(self):
+        # every GOTO/GOSUB/THEN target is known at entry time, so report bad ones before running
+        index = self._get_line_index()
+        for lineno, line in self.lines_sorted:
+            for target in line.targets:
+                if target not in index:
+                    self.error = f"?UNDEF'D STATEMENT ERROR IN {lineno}"
+                    self.out.line(self.error)
+                    return False
+        return True
 
     def _find_line_index(self, target):
-        # binary search for line index with number==target
-        for i,(ln,_t) in enumerate(self.lines_sorted):
-            if ln == target:
-                return i
-        return None
+        return self._get_line_index().get(target)
 
-    def _exec_stmt(self, stmt, lineno):
-        toks = tokenize(stmt)
+    def _exec_stmt(self, toks, lineno):
         if not toks:
             return
         first = toks[0]
-        if first[0] == 'REM':
+        if first[0] in ('REM', 'DATA'):
             return
         if first[0] == 'PRINT':
             self._do_PRINT(toks[1:])
@@ -361,45 +943,36 @@ class BasicInterpreter:
         if first[0] == 'LET':
             # skip LET
             toks = toks[1:]
+        # handle array element assignment: NAME(subscripts) = expr
+        if len(toks) >= 2 and toks[0][0] == 'NAME' and toks[1][0] == 'LPAREN':
+            name, subs, n = parse_lvalue(toks)
+            if n < len(toks) and toks[n] == ('OP', '='):
+                line = self.cur_line
+                idx = [line.expr(s, self.vars)() for s in subs]
+                self.vars.set_elem(name, idx, line.expr(toks[n+1:], self.vars)())
+                return
         # handle assignment: NAME = expr
         if len(toks) >= 3 and toks[0][0] == 'NAME' and toks[1][0] == 'OP' and toks[1][1] == '=':
             name = toks[0][1]
             try:
-                rpn = to_rpn(toks[2:])
+                expr = self.cur_line.expr(toks[2:], self.vars)
             except RuntimeError as e:
-                self.output_callback(str(e).upper())
-            val = eval_rpn(rpn, self.vars)
-            if name.endswith('$'):
-                # strings may be assigned from NUMBER -> convert
-                if isinstance(val, float):
-                    self.vars[name] = str(val)
-                else:
-                    self.vars[name] = val
-            else:
-                # numeric
-                if isinstance(val, str):
-                    try:
-                        self.vars[name] = float(val)
-                    except:
-                        self.vars[name] = 0.0
-                else:
-                    self.vars[name] = float(val)
+                self.out.line(str(e).upper())
+            self._assign(name, expr())
             return
         # INPUT
         if first[0] == 'INPUT':
             # simplified: INPUT A,B$ -> prompt and assign
-            rest = stmt[len('INPUT'):].strip()
-            names = [n.strip().upper() for n in rest.split(',')]
-            for nm in names:
-                if nm.endswith('$'):
-                    v = input("? ")
-                    self.vars[nm] = v
-                else:
-                    v = input("? ")
-                    try:
-                        self.vars[nm] = float(v)
-                    except:
-                        self.vars[nm] = 0.0
+            self._do_INPUT(self._targets(toks[1:], self.cur_line))
+            return
+        # DIM A(10), B$(2,3)
+        if first[0] == 'DIM':
+            self._do_DIM(self._targets(toks[1:], self.cur_line))
+            return
+        # POKE address, value
+        if first[0] == 'POKE':
+            addr, value = self._poke_args(toks[1:], self.cur_line)
+            self.memory.poke(addr(), value())
             return
         # GOTO
         if first[0] == 'GOTO':
@@ -423,6 +996,7 @@ class BasicInterpreter:
             if idx is None:
                 raise RuntimeError(f"GOTO TO UNKNOWN line {target}")
             self.pc_index = idx
+            self.jumped = True
             return
         # GOSUB
         if first[0] == 'GOSUB':
@@ -433,12 +1007,14 @@ class BasicInterpreter:
             # push return index (next line)
             self.gosub_stack.append(self.pc_index + 1)
             self.pc_index = idx
+            self.jumped = True
             return
         # RETURN
         if first[0] == 'RETURN':
             if not self.gosub_stack:
                 raise RuntimeError("RETURN WITHOUT GOSUB")
             self.pc_index = self.gosub_stack.pop()
+            self.jumped = True
             return
         # IF ... THEN line
         if first[0] == 'IF':
@@ -451,17 +1027,15 @@ class BasicInterpreter:
                 raise SyntaxError("IF WITHOUT THEN")
             expr_tokens = toks[1:then_idx]
             try:
-                print(expr_tokens)
-                rpn = to_rpn(expr_tokens)
-                print(rpn)
+                expr = self.cur_line.expr(expr_tokens, self.vars)
             except RuntimeError as e:
-                self.output_callback(str(e).upper())
-            cond = eval_rpn(rpn, self.vars)
-            print(cond)
+                self.out.line(str(e).upper())
+            cond = expr()
             if cond != 0 and cond != '' and cond is not None:
-                print("Condition is true!")
                 # jump to line given after THEN (simple numeric token)
                 targettok = toks[then_idx+1]
+                if targettok[0] == 'GOTO' and len(toks) > then_idx + 2:
+                    targettok = toks[then_idx+2]    # IF ... THEN GOTO n, as the compiler takes it
                 
                 # if targettok[0] == 'NUMBER': target = int(targettok[1])
                 # elif targettok[0] == 'NAME': target = int(targettok[1])
@@ -481,11 +1055,12 @@ class BasicInterpreter:
                 # luck.
                 #                                            CosmicBit128
                 #                        29 Dec 2025 (later the same day)
-                target = int(tergettok[1])
+                target = int(targettok[1])
                 idx = self._find_line_index(target)
                 if idx is None:
                     raise RuntimeError(f"IF THEN to unknown line {target}")
                 self.pc_index = idx
+                self.jumped = True
             return
         # FOR var = start TO end [STEP n]
         if first[0] == 'FOR':
@@ -499,27 +1074,28 @@ class BasicInterpreter:
             if 'TO' not in kinds:
                 raise SyntaxError("FOR WITHOUT TO")
             to_idx = kinds.index('TO')
+            line = self.cur_line
             try:
-                rpn_start = to_rpn(toks[3:to_idx])
+                expr_start = line.expr(toks[3:to_idx], self.vars)
             except RuntimeError as e:
-                self.output_callback(str(e).upper())
-            start = eval_rpn(rpn_start, self.vars)
+                self.out.line(str(e).upper())
+            start = expr_start()
             # find STEP if present
             if 'STEP' in kinds:
                 step_idx = kinds.index('STEP')
                 try:
-                    rpn_end = to_rpn(toks[to_idx+1:step_idx])
-                    rpn_step = to_rpn(toks[step_idx+1:])
+                    expr_end = line.expr(toks[to_idx+1:step_idx], self.vars)
+                    expr_step = line.expr(toks[step_idx+1:], self.vars)
                 except RuntimeError as e:
-                    self.output_callback(str(e).upper())
-                step = eval_rpn(rpn_step, self.vars)
+                    self.out.line(str(e).upper())
+                step = expr_step()
             else:
                 try:
-                    rpn_end = to_rpn(toks[to_idx+1:])
+                    expr_end = line.expr(toks[to_idx+1:], self.vars)
                 except RuntimeError as e:
-                    self.output_callback(str(e).upper())
+                    self.out.line(str(e).upper())
                 step = 1.0
-            end = eval_rpn(rpn_end, self.vars)
+            end = expr_end()
             self.vars[var] = float(start)
             # push frame: var, end, step, next-line-index (current next)
             self.for_stack.append((var, float(end), float(step), self.pc_index + 1))
@@ -539,6 +1115,7 @@ class BasicInterpreter:
             if cont:
                 # jump back to loop body (ret_index)
                 self.pc_index = ret_index
+                self.jumped = True
             else:
                 # pop and continue after NEXT (do nothing; loop will advance)
                 self.for_stack.pop()
@@ -546,21 +1123,7 @@ class BasicInterpreter:
         # DATA READ RESTORE
         if first[0] == 'READ':
             # READ A,B$
-            rest = stmt[len('READ'):].strip()
-            names = [n.strip().upper() for n in rest.split(',')]
-            for nm in names:
-                if self.data_ptr >= len(self.data):
-                    self.output_callback("OUT OF DATA")
-                    self.vars[nm] = 0.0
-                else:
-                    val = self.data[self.data_ptr]; self.data_ptr += 1
-                    if nm.endswith('$'):
-                        self.vars[nm] = val
-                    else:
-                        try:
-                            self.vars[nm] = float(val)
-                        except:
-                            self.vars[nm] = 0.0
+            self._do_READ(self._targets(toks[1:], self.cur_line))
             return
         if first[0] == 'RESTORE':
             self.data_ptr = 0
@@ -575,57 +1138,87 @@ class BasicInterpreter:
             # try to evaluate
             try:
                 try:
-                    rpn = to_rpn(toks)
+                    expr = self.cur_line.expr(toks, self.vars)
                 except RuntimeError as e:
-                    self.output_callback(str(e).upper())
-                val = eval_rpn(rpn, self.vars)
-                self.output_callback(val)
+                    self.out.line(str(e).upper())
+                val = expr()
+                self.out.line(val)
             except Exception as e:
                 raise
             return
-        raise SyntaxError("Unknown statement: " + stmt)
+        raise SyntaxError("Unknown statement: " + ' '.join(str(t[1]) for t in toks))
+
+    def _assign(self, name, val):
+        # strings may be assigned from NUMBER and numbers from STRING -> convert
+        self.vars.assign(name, val)
+
+    def _targets(self, toks, line):
+        # variables named by INPUT/READ/DIM: (name, compiled subscripts or None);
+        # subscripts stay unevaluated so READ I,A(I) sees the new I
+        targets = []
+        for arg in split_args(toks):
+            while arg and arg[0][0] != 'NAME':
+                arg = arg[1:]   # INPUT "PROMPT"; A
+            if arg:
+                name, subs, _ = parse_lvalue(arg)
+                targets.append((name, [line.expr(s, self.vars) for s in subs] if subs else None))
+        return targets
+
+    def _poke_args(self, toks, line):
+        args = split_args(toks)
+        if len(args) != 2 or not all(args):
+            raise SyntaxError("SYNTAX")
+        return [line.expr(a, self.vars) for a in args]
+
+    def _store(self, name, subs, val):
+        if subs is None:
+            self.vars.assign(name, val)
+        else:
+            self.vars.set_elem(name, [f() for f in subs], val)
+
+    def _do_INPUT(self, targets):
+        self.flush()    # the prompt has to be on screen before we wait
+        for name, subs in targets:
+            self._store(name, subs, input("? "))
+
+    def _do_READ(self, targets):
+        for name, subs in targets:
+            if self.data_ptr >= len(self.data):
+                self.out.line("OUT OF DATA")
+                val = 0.0
+            else:
+                val = self.data[self.data_ptr]; self.data_ptr += 1
+            self._store(name, subs, val)
+
+    def _do_DIM(self, targets):
+        for name, subs in targets:
+            if subs is None:
+                raise SyntaxError("MALFORMED DIM")
+            self.vars.dim(name, [f() for f in subs])
 
     def _do_PRINT(self, toks):
-        # Very basic PRINT: prints expressions and strings, supports ;
-        out_parts = []
-        i = 0
-        sep = ' '
-        while i < len(toks):
-            t = toks[i]
-            if t[0] == 'STRING':
-                out_parts.append(t[1])
-                i += 1
+        self._print(*self.cur_line.print_items(toks, self.vars))
+
+    def _print(self, items, newline):
+        out = self.out
+        for f in items:
+            if f is None:
+                out.tab()
             else:
-                # read tokens until semicolon
-                sub = []
-                while i < len(toks) and not (toks[i][0] == 'OP' and toks[i][1] == ';'):
-                    sub.append(toks[i]); i += 1
-                if sub:
-                    try:
-                        rpn = to_rpn(sub)
-                    except RuntimeError as e:
-                        self.output_callback(str(e).upper())
-                        continue
-                    v = eval_rpn(rpn, self.vars)
-                    out_parts.append(str(v))
-            if i < len(toks) and toks[i][0] == 'OP':
-                op = toks[i][1]
-                if op == ',':
-                    sep = ' '
-                elif op == ';':
-                    sep = ''
-                i += 1
-        # join respecting sep: naive: join with sep between items
-        if sep == '':
-            self.output_callback(''.join(out_parts), end='')
-        else:
-            self.output_callback(sep.join(out_parts))
+                v = f()
+                out.write(v if v.__class__ is str else str(v))
+        if newline:
+            out.newline()
+
+    def flush(self):
+        """Hand everything printed so far to output_callback."""
+        self.out.flush()
 
 # -----------------------
 # REPL
 # -----------------------
 def out_call(text):
-    print(text)
+    sys.stdout.write(text)
 
 def repl():
     bi = BasicInterpreter(out_call)
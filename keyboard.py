@@ -7,6 +7,12 @@ class KeyboardHandler:
         self.post = app.post
 
     def keydown_callback(self, e):
+        if self.app.inter.running:
+            # a program owns the screen: only RUN/STOP gets through
+            if e.key == pg.K_ESCAPE:
+                self.app.inter.stop()
+            return
+
         if e.key == pg.K_RETURN:
             self.app.screen.cur_pos[1] += 1
             self.app.screen.cur_pos[0] = 0
@@ -1,48 +1,77 @@
 import moderngl as mgl
 import pygame as pg
+import time
 
 from settings import *
 from screen import Screen
-from post import PostProcess
+from post import PostProcess, SoftwarePost
 from keyboard import KeyboardHandler
 from interpreter import BasicInterpreter
+from scheduler import FrameScheduler
 
 
 class Renderer:
-    def __init__(self, win_res, framerate: float = 60.0):
+    def __init__(self, win_res, framerate: float = 60.0, software=SOFTWARE_RENDER):
         pg.init()
+        self.ctx = None
+        if not software:
+            try:
+                self.init_gl(win_res)
+            except Exception as e:
+                print(f"OpenGL 4.0 unavailable ({e}), using the software renderer")
+                software = True
+        if software:
+            pg.display.set_mode(win_res, flags=RESIZABLE)
+        pg.display.set_caption("Commodore 64 BASIC Interpreter")
+        self.software = software
+
+        self.fps = framerate
+
+        # Time
+        self.frames = FrameScheduler(framerate)
+        self.time = 0
+        self.dt = 0
+        self.report_time = 0
+        self.exposed = True     # the window needs a redraw whatever changed
+
+        # Setup modules
+        self.on_init()
 
+    def init_gl(self, win_res):
         pg.display.gl_set_attribute(pg.GL_CONTEXT_MAJOR_VERSION, 4)
         pg.display.gl_set_attribute(pg.GL_CONTEXT_MINOR_VERSION, 0)
         pg.display.gl_set_attribute(pg.GL_CONTEXT_PROFILE_MASK, pg.GL_CONTEXT_PROFILE_CORE)
         pg.display.gl_set_attribute(pg.GL_DEPTH_SIZE, 24)
 
         pg.display.set_mode(win_res, flags=FLAGS)
-        pg.display.set_caption("Commodore 64 BASIC Interpreter")
         self.ctx = mgl.create_context()
 
         self.ctx.enable(mgl.DEPTH_TEST | mgl.CULL_FACE | mgl.BLEND)
         self.ctx.gc_mode = 'auto'
 
-        self.fps = framerate
-
-        # Time
-        self.clock = pg.time.Clock()
-        self.time = 0
-        self.dt = 0
-
-        # Setup modules
-        self.on_init()
-
     def on_init(self):
         self.screen = Screen(self)
-        self.post = PostProcess(self)
-        self.inter = BasicInterpreter(self.post.out_callback)
+        self.post = SoftwarePost(self) if self.software else PostProcess(self)
+        self.inter = BasicInterpreter(self.post.out_callback, sliced=True, mode=BASIC_MODE,
+                                      memory=self.screen.memory)
         self.kb = KeyboardHandler(self)
 
-    def update(self):
-        self.dt = self.clock.tick(0)
+    def update(self, dt):
+        self.dt = dt * 1000
         self.time = pg.time.get_ticks()*0.001
+        sched = self.inter.scheduler
+        if self.inter.running:
+            t = time.perf_counter()
+            # turbo runs get whatever the frame has left before rendering
+            sched.frame(self.inter, dt, self.frames.deadline())
+            self.frames.measure('interp', time.perf_counter() - t)
+        self.inter.flush()
+        if self.time - self.report_time >= 1.0:
+            self.report_time = self.time
+            caption = f"Commodore 64 BASIC Interpreter - {self.frames.report()}"
+            if self.inter.running and sched.run_mode == 'turbo':
+                caption += f", {sched.rate():.0f} statements/s"
+            pg.display.set_caption(caption)
         self.post.update()
 
         keys = pg.key.get_pressed()
@@ -52,8 +81,16 @@ class Renderer:
             self.post.c -= 0.01
 
     def render(self):
+        # an idle screen costs nothing: only draw when something visible changed
+        if not (self.post.changed() or self.exposed):
+            self.frames.skipped += 1
+            return
+        t = time.perf_counter()
+        self.exposed = False
         self.post.render()
         pg.display.flip()
+        self.frames.rendered += 1
+        self.frames.measure('render', time.perf_counter() - t)
 
     def events(self):
         for e in pg.event.get():
@@ -63,12 +100,17 @@ class Renderer:
             
             if e.type == pg.KEYDOWN:
                 self.kb.keydown_callback(e)
-            
+
+            if e.type in (pg.VIDEORESIZE, pg.WINDOWEXPOSED):
+                self.exposed = True
+
     def run(self):
         while True:
+            dt = self.frames.begin()
             self.events()
-            self.update()
+            self.update(dt)
             self.render()
+            self.frames.wait()
 
     def create_mgl_texture_from_surface(self, surface):
         surf_data = pg.image.tobytes(surface, "RGBA", True)
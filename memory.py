@@ -0,0 +1,59 @@
+import math
+
+
+# -----------------------
+# Memory map
+# -----------------------
+# 64K of RAM as one bytearray. Screen and colour RAM are not copies: Screen
+# keeps its cells and colours as NumPy views into ram, so POKEs there show up
+# on the next frame and PRINT output can be PEEKed back.
+SCREEN_RAM = 1024       # 40x25 screen codes
+COLOUR_RAM = 55296      # 40x25 colours, low nybble
+SCREEN_SIZE = 1000
+
+
+def _address(a):
+    a = math.floor(a)
+    if not 0 <= a <= 0xFFFF:
+        raise RuntimeError("ILLEGAL QUANTITY")
+    return a
+
+
+class Memory:
+    def __init__(self):
+        self.ram = bytearray(0x10000)
+        self.screen = None  # Screen mapped over SCREEN_RAM and COLOUR_RAM, set by Screen
+        self.sync = None    # flushes pending PRINT output before screen RAM is touched
+
+    def _screen_row(self, a):
+        """Screen row an address in screen or colour RAM falls on, or None; brings the screen up to date first."""
+        screen = self.screen
+        if screen is None:
+            return None
+        off = a - SCREEN_RAM
+        if not 0 <= off < SCREEN_SIZE:
+            off = a - COLOUR_RAM
+            if not 0 <= off < SCREEN_SIZE:
+                return None
+        if self.sync is not None:
+            self.sync()
+        # the screen keeps its rows in a ring; memory order is screen order
+        screen.normalise()
+        return off // 40
+
+    def peek(self, a):
+        a = _address(a)
+        self._screen_row(a)
+        return self.ram[a]
+
+    def poke(self, a, v):
+        a = _address(a)
+        v = math.floor(v)
+        if not 0 <= v <= 255:
+            raise RuntimeError("ILLEGAL QUANTITY")
+        row = self._screen_row(a)
+        if COLOUR_RAM <= a < COLOUR_RAM + SCREEN_SIZE:
+            v &= 15
+        self.ram[a] = v
+        if row is not None:
+            self.screen.touch(row, row + 1)
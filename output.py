@@ -0,0 +1,47 @@
+# -----------------------
+# Output buffering
+# -----------------------
+# PRINT and the interpreter's messages append to an OutputBuffer instead of
+# calling out once per line; the host drains it with flush() (once per frame,
+# after a command) and sink gets the text as one chunk, newlines included.
+class OutputBuffer:
+    def __init__(self, sink, width=40, zone=10, limit=16384):
+        self.sink = sink
+        self.width = width  # screen columns, for wrapping the column count
+        self.zone = zone    # tab zone width for PRINT ,
+        self.limit = limit  # flush on its own past this many pending chars
+        self.parts = []
+        self.size = 0
+        self.col = 0        # column the next character lands in
+
+    def write(self, text):
+        self.parts.append(text)
+        nl = text.rfind('\n')
+        if nl < 0:
+            self.col = (self.col + len(text)) % self.width
+        else:
+            self.col = (len(text) - nl - 1) % self.width
+        self.size += len(text)
+        if self.size > self.limit:
+            self.flush()
+
+    def newline(self):
+        self.write('\n')
+
+    def line(self, text):
+        self.write(f"{text}\n")
+
+    def tab(self):
+        """PRINT ,: move to the next tab zone, or the next line from the last one."""
+        nxt = (self.col // self.zone + 1) * self.zone
+        if nxt >= self.width:
+            self.newline()
+        else:
+            self.write(' ' * (nxt - self.col))
+
+    def flush(self):
+        if self.parts:
+            text = ''.join(self.parts)
+            self.parts.clear()
+            self.size = 0
+            self.sink(text)
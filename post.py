@@ -1,6 +1,75 @@
-from moderngl import TRIANGLE_STRIP
+from moderngl import TRIANGLE_STRIP, NEAREST
 from settings import *
+import operator
+import ast
 import pygame as pg
+from raster import Rasteriser, load_glyphs, COLOURS
+
+
+# -----------------------
+# Uniform bindings
+# -----------------------
+# Values in shaders/*.json are small Python expressions: literals, settings
+# constants (WIN_RES), attribute paths on the PostProcess (self.app.screen.cur_pos)
+# and + - * / between them. They are compiled once into getters; anything
+# else is rejected, so the files can't run arbitrary code.
+UNIFORM_NAMES = {k: v for k, v in globals().items() if k.isupper()}
+UNIFORM_OPS = {ast.Add: operator.add, ast.Sub: operator.sub,
+               ast.Mult: operator.mul, ast.Div: operator.truediv}
+
+
+def _const(v):
+    return lambda: v
+
+
+def _uniform_node(node, owner):
+    # (getter, constant?) for an expression node
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, bool)):
+        return _const(node.value), True
+    if isinstance(node, (ast.Tuple, ast.List)):
+        items = [_uniform_node(n, owner) for n in node.elts]
+        getters = [g for g, _ in items]
+        get = lambda: tuple(g() for g in getters)
+        if all(c for _, c in items):
+            return _const(get()), True
+        return get, False
+    if isinstance(node, ast.Name) and node.id in UNIFORM_NAMES:
+        return _const(UNIFORM_NAMES[node.id]), True
+    if isinstance(node, ast.Attribute):
+        path = []
+        while isinstance(node, ast.Attribute):
+            path.append(node.attr)
+            node = node.value
+        if isinstance(node, ast.Name) and node.id == 'self' and not any(p.startswith('_') for p in path):
+            get = operator.attrgetter('.'.join(reversed(path)))
+            return (lambda: get(owner)), False
+    if isinstance(node, ast.BinOp) and type(node.op) in UNIFORM_OPS:
+        op = UNIFORM_OPS[type(node.op)]
+        (lg, lc), (rg, rc) = _uniform_node(node.left, owner), _uniform_node(node.right, owner)
+        get = lambda: op(lg(), rg())
+        if lc and rc:
+            return _const(get()), True
+        return get, False
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        g, c = _uniform_node(node.operand, owner)
+        get = lambda: -g()
+        return (_const(get()), True) if c else (get, False)
+    raise ValueError(f"unsupported uniform expression: {ast.dump(node)}")
+
+
+def compile_uniform(spec, owner):
+    """Getter for a uniform spec from a shader json file, and whether it is constant."""
+    if isinstance(spec, (list, tuple)):
+        v = tuple(float(i) for i in spec)
+        return _const(v), True
+    if isinstance(spec, (int, float)):
+        return _const(spec), True
+    return _uniform_node(ast.parse(spec, mode='eval').body, owner)
+
+
+def _snapshot(v):
+    # lists (like cur_pos) are mutated in place, so remember a copy
+    return tuple(v) if isinstance(v, list) else v
 
 
 class PostProcess:
@@ -9,6 +78,7 @@ class PostProcess:
         self.ctx = app.ctx
         self.c = 0
         self.ce = True
+        self.blink = False  # cursor phase, flips every quarter second
         self.palettes = {
             'apple': [
                 glm.vec3(0.01, 0.01, 0.01),
@@ -20,13 +90,8 @@ class PostProcess:
             ]
         }
         self.color = self.palettes['c64']
-
-        # Font
-        self.font = pg.transform.scale_by(pg.image.load('res/glyph.png'), SCALING)
-        pixels = pg.PixelArray(self.font)
-        pixels.replace(pg.Color('#ffffff'), pg.Color(*self.color[0]*255))
-        pixels.replace(pg.Color('#000000'), pg.Color(*self.color[1]*255))
-        del pixels
+        self.shown = None   # screen generation and cursor state disp_texture was drawn with
+        self.presented = None   # that plus the CRT settings, for the last frame on screen
 
         # Post-Processing Render Passes
         self.passes = {
@@ -38,6 +103,15 @@ class PostProcess:
         self.disp_texture = self.ctx.texture(WIN_RES//SCALING, 4)
         self.fbo_texture = self.ctx.texture(WIN_RES, 4)
         self.disp = self.ctx.framebuffer(color_attachments=[self.disp_texture])
+
+        # Screen codes and colours, one R8UI texel per cell; texture rows are
+        # Screen.cells rows, i.e. the ring buffer, and display.frag applies
+        # the head offset. Both are uploaded straight from screen/colour RAM
+        self.chars = self.ctx.texture((40, 25), 1, dtype='u1')
+        self.chars.filter = (NEAREST, NEAREST)
+        self.colours = self.ctx.texture((40, 25), 1, dtype='u1')
+        self.colours.filter = (NEAREST, NEAREST)
+        self.inks = [glm.vec3(*(c / 255)) for c in COLOURS]
         self.fbo = self.ctx.framebuffer(color_attachments=[self.fbo_texture])
 
         self.quad_vertices = np.array([
@@ -60,38 +134,42 @@ class PostProcess:
         self.set_uniforms_on_init()
 
     def update(self):
-        surf = pg.Surface(WIN_RES)
-        surf.fill(self.color[1]*255)
-        surf.fill(self.color[0]*255, (32*SCALING, 36*SCALING, 320*SCALING, 200*SCALING))
-        # 15 -> 8 | 600 -> 320 | 720 -> 384
-        # 16 -> 8 | 400 -> 200 | 544 -> 272
-        # Draw Screen
-        for y in range(25):
-            for x in range(40):
-                char = int(self.app.screen.screen[x, y])
-                cx, cy = (char%16, char//16)
-                if [x, y]==self.app.screen.cur_pos and self.app.time%.5<.25:
-                    cy += 8
-                surf.blit(
-                    self.font.subsurface(SCALING*cx*8, SCALING*cy*8, SCALING*8, SCALING*8),
-                    ((32 + x*8)*SCALING, (36 + y*8)*SCALING)
-                )
-        self.screen_texture, w, h = self.app.create_mgl_texture_from_surface(surf)
-    
+        self.blink = self.app.time % .5 < .25
+
+    def changed(self):
+        """Whether the next frame would look different from the last one drawn."""
+        screen = self.app.screen
+        state = (screen.generation, tuple(screen.cur_pos), self.blink, self.c, self.ce)
+        if state == self.presented:
+            return False
+        self.presented = state
+        return True
+
     def render(self):
-        # Display pass
-        display_pass = self.passes['display']
-        prog, uniforms, _, vao = display_pass
+        # Display pass: glyphs are drawn by display.frag into disp_texture,
+        # which is only redrawn when the screen or the cursor changed
+        screen = self.app.screen
+        shown = (screen.generation, tuple(screen.cur_pos), self.blink)
+        if shown != self.shown:
+            self.shown = shown
+            rows = screen.take_dirty()
+            if rows is not None:
+                lo, hi = rows
+                self.chars.write(screen.cells[lo:hi], viewport=(0, lo, 40, hi - lo))
+                self.colours.write(screen.colours[lo:hi], viewport=(0, lo, 40, hi - lo))
 
-        self.disp.use()
-        self.disp.clear(color=BG_COLOR)
-        self.glyph.use(location=0)
+            display_pass = self.passes['display']
+            prog, uniforms, _, vao = display_pass
 
-        # Set uniforms
-        for k, v in uniforms['update'].items():
-            prog[k].value = eval(v)
+            self.disp.use()
+            self.disp.clear(color=BG_COLOR)
+            self.glyph.use(location=0)
+            self.chars.use(location=1)
+            self.colours.use(location=2)
 
-        vao.render(TRIANGLE_STRIP)
+            self.set_uniforms(prog, uniforms)
+
+            vao.render(TRIANGLE_STRIP)
 
         # CRT pass
         crt_pass = self.passes['crt']
@@ -103,29 +181,44 @@ class PostProcess:
         self.disp_texture.use(location=0)
         self.fbo_texture.use(location=1)
 
-        # Set uniforms
-        for k, v in uniforms['update'].items():
-            prog[k].value = eval(v)
+        self.set_uniforms(prog, uniforms)
 
         vao.render(TRIANGLE_STRIP)
         self.fbo.clear(color=BG_COLOR)
         self.ctx.copy_framebuffer(self.fbo, self.ctx.screen)
 
     def out_callback(self, text):
-        self.app.screen.write(*self.app.screen.cur_pos, f"{text}\n")
+        self.app.screen.write(*self.app.screen.cur_pos, text, capture=False)
 
     def set_uniforms_on_init(self):
         for shader in self.passes.keys():
-            for k, v in self.passes[shader][1]['init'].items():
-                self.passes[shader][0][k].value = eval(v)
+            prog, uniforms = self.passes[shader][:2]
+            for k, get in uniforms['init']:
+                prog[k].value = get()
+            # constant 'update' entries only need writing once too
+            for k, get in uniforms['const']:
+                prog[k].value = get()
+
+    def set_uniforms(self, prog, uniforms):
+        # only write the uniforms whose value changed since the last frame
+        last = uniforms['last']
+        for k, get in uniforms['update']:
+            v = get()
+            snap = _snapshot(v)
+            if k not in last or last[k] != snap:
+                last[k] = snap
+                prog[k].value = v
 
     def get_uniforms(self, name):
         with open(f'shaders/{name}.json', 'r') as f:
             data = json.load(f)
-        for k, v in data['update'].items():
-            if isinstance(data['update'][k], (list, tuple)):
-                data['update'][k] = [float(i) for i in v]
-        return data
+        uniforms = {'init': [], 'update': [], 'const': [], 'last': {}}
+        for k, spec in data.get('init', {}).items():
+            uniforms['init'].append((k, compile_uniform(spec, self)[0]))
+        for k, spec in data.get('update', {}).items():
+            get, const = compile_uniform(spec, self)
+            uniforms['const' if const else 'update'].append((k, get))
+        return uniforms
     
     def get_program(self, shader_name):
         with open(f'shaders/screen.vert') as file:
@@ -134,4 +227,42 @@ class PostProcess:
             fragment_shader = file.read()
 
         program = self.ctx.program(vertex_shader=vertex_shader, fragment_shader=fragment_shader)
-        return program
\ No newline at end of file
+        return program
+
+
+class SoftwarePost:
+    """Stand-in for PostProcess without OpenGL: the NumPy rasteriser blitted through pygame."""
+    def __init__(self, app):
+        self.app = app
+        self.c = 0
+        self.ce = False     # no CRT pass in software
+        self.blink = False
+        self.shown = None
+        self.presented = None
+        self.raster = Rasteriser(load_glyphs())
+        self.frame = pg.Surface(self.raster.frame.shape[1::-1])
+
+    def update(self):
+        self.blink = self.app.time % .5 < .25
+
+    def changed(self):
+        screen = self.app.screen
+        state = (screen.generation, tuple(screen.cur_pos), self.blink)
+        if state == self.presented:
+            return False
+        self.presented = state
+        return True
+
+    def render(self):
+        screen = self.app.screen
+        shown = (screen.generation, tuple(screen.cur_pos), self.blink)
+        if shown != self.shown:
+            self.shown = shown
+            frame = self.raster.draw(screen.screen, screen.cur_pos if self.blink else None,
+                                     screen.colour_screen)
+            pg.surfarray.blit_array(self.frame, frame.swapaxes(0, 1))
+        display = pg.display.get_surface()
+        pg.transform.scale(self.frame, display.get_size(), display)
+
+    def out_callback(self, text):
+        self.app.screen.write(*self.app.screen.cur_pos, text, capture=False)
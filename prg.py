@@ -0,0 +1,136 @@
+import mmap
+import re
+import struct
+
+from interpreter import TOK_RE, KEYWORDS as STATEMENTS, FUNCS, tokenize
+
+
+# -----------------------
+# C64 PRG files
+# -----------------------
+# A BASIC program as the C64 keeps it in memory, behind a 2-byte load
+# address: per line a link to the next line, the line number and the text
+# with keywords crunched to single bytes (0x80-0xCB), ending in 0; two zero
+# bytes end the program. Text outside keywords is stored as latin-1, which
+# is PETSCII for upper case letters, digits and punctuation.
+LOAD_ADDRESS = 0x0801
+
+KEYWORDS = [    # in token order, from 0x80; crunching tries them in this order too
+    'END', 'FOR', 'NEXT', 'DATA', 'INPUT#', 'INPUT', 'DIM', 'READ', 'LET', 'GOTO', 'RUN',
+    'IF', 'RESTORE', 'GOSUB', 'RETURN', 'REM', 'STOP', 'ON', 'WAIT', 'LOAD', 'SAVE',
+    'VERIFY', 'DEF', 'POKE', 'PRINT#', 'PRINT', 'CONT', 'LIST', 'CLR', 'CMD', 'SYS',
+    'OPEN', 'CLOSE', 'GET', 'NEW', 'TAB(', 'TO', 'FN', 'SPC(', 'THEN', 'NOT', 'STEP',
+    '+', '-', '*', '/', '^', 'AND', 'OR', '>', '=', '<', 'SGN', 'INT', 'ABS', 'USR',
+    'FRE', 'POS', 'SQR', 'RND', 'LOG', 'EXP', 'COS', 'SIN', 'TAN', 'ATN', 'PEEK', 'LEN',
+    'STR$', 'VAL', 'ASC', 'CHR$', 'LEFT$', 'RIGHT$', 'MID$', 'GO',
+]
+CODES = {kw: 0x80 + i for i, kw in enumerate(KEYWORDS)}
+REM, DATA = CODES['REM'], CODES['DATA']
+
+# what each keyword character of a crunched line lexes to
+KEYWORD_TOKENS = {chr(0x80 + i): tokenize(kw) for i, kw in enumerate(KEYWORDS)}
+
+DATA_RE = re.compile(r'(?:"[^"]*"?|[^:"])*')    # DATA items run to the next ':' outside quotes
+BEFORE_REM_RE = re.compile(r'(?:"[^"]*"?|[^"\x8f])*')
+EXPAND = {0x80 + i: kw for i, kw in enumerate(KEYWORDS)}     # str.translate table for LIST text
+
+
+def crunch(text):
+    """Tokenized bytes for one line of program text, the way the C64 editor stores it.
+
+    The line is lexed as tokenize() reads it, and only what that reads as a
+    keyword, function or operator is crunched: a name like SCORE or TOTAL
+    keeps its text rather than becoming SC OR E or TO TAL."""
+    out = bytearray()
+    pos = 0
+    while pos < len(text):
+        m = TOK_RE.match(text, pos)
+        if m is None:
+            break
+        kind, txt = m.lastgroup, m.group(0)
+        pos = m.end()
+        code = None
+        if kind == 'NAME':
+            up = txt.upper()
+            if up in STATEMENTS or up in FUNCS:
+                if text.startswith('(', pos) and up + '(' in CODES:
+                    code = CODES[up + '(']     # TAB( and SPC( take their bracket
+                    pos += 1
+                else:
+                    code = CODES.get(up)
+        elif kind == 'BITWISE':
+            code = CODES[txt]
+        elif kind == 'OP' and txt[0] in CODES:
+            out += bytes(CODES[c] for c in txt)     # <= and <> crunch as two keywords
+            continue
+        if code is None:
+            out += txt.encode('latin-1', 'replace')
+            if txt == '"':
+                break   # a quote left open runs to the end of the line
+            continue
+        out.append(code)
+        if code == REM:
+            break
+        if code == DATA:
+            m = DATA_RE.match(text, pos)
+            out += m.group(0).encode('latin-1', 'replace')
+            pos = m.end()
+    out += text[pos:].encode('latin-1', 'replace')
+    return bytes(out)
+
+
+def _expand(code):
+    if '"' not in code:
+        return code.translate(EXPAND)
+    # keyword characters inside quotes are just characters
+    parts = code.split('"')
+    parts[::2] = [p.translate(EXPAND) for p in parts[::2]]
+    return '"'.join(parts)
+
+
+def decode_line(body):
+    """(text, tokens) of a crunched line: text as LIST shows it, tokens lexed from the crunched form."""
+    code = body.decode('latin-1')
+    comment = ''
+    if '\x8f' in code:
+        # after REM the bytes are comment, not keywords
+        n = BEFORE_REM_RE.match(code).end() + 1
+        code, comment = code[:n], code[n:]
+    return _expand(code) + comment, tokenize(code, KEYWORD_TOKENS)
+
+
+def write_prg(path, lines):
+    """Save (lineno, text) pairs as a PRG file."""
+    out = bytearray(struct.pack('<H', LOAD_ADDRESS))
+    addr = LOAD_ADDRESS
+    for lineno, text in lines:
+        body = crunch(text)
+        addr += 5 + len(body)
+        if addr > 0xFFFF or lineno > 0xFFFF:
+            raise ValueError("program doesn't fit in 64K")
+        out += struct.pack('<HH', addr, lineno) + body + b'\0'
+    out += b'\0\0'
+    with open(path, 'wb') as f:
+        f.write(out)
+
+
+def read_prg(path):
+    """(lineno, text, tokens) for each line of a PRG file.
+
+    The file is mapped rather than read, and the line links are ignored, as
+    the C64 does when it relinks a program loaded at another address."""
+    with open(path, 'rb') as f:
+        if not f.seek(0, 2):
+            raise ValueError(f"{path}: empty file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            lines = []
+            pos = 2
+            while pos + 4 <= len(m) and m[pos:pos + 2] != b'\0\0':
+                lineno, = struct.unpack_from('<H', m, pos + 2)
+                end = m.find(b'\0', pos + 4)
+                if end < 0:
+                    raise ValueError(f"{path}: line {lineno} has no end")
+                text, toks = decode_line(m[pos + 4:end])
+                lines.append((lineno, text, toks))
+                pos = end + 1
+            return lines
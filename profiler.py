@@ -0,0 +1,67 @@
+# -----------------------
+# Profiler
+# -----------------------
+# Filled in by BasicInterpreter while a program runs under PROFILE: execution
+# counts and time per line and per statement kind, plus time per GOSUB call
+# stack for flamegraph-style collapsed output.
+def stmt_kind(toks):
+    """Profile bucket for a statement: its keyword, LET for assignments, EXPR for bare expressions."""
+    if not toks:
+        return 'EMPTY'
+    kind = toks[0][0]
+    if kind in ('NAME', 'NUMBER', 'BITWISE', 'FUNC', 'STRING', 'LPAREN', 'OP'):
+        return 'LET' if kind == 'NAME' and ('OP', '=') in toks else 'EXPR'
+    return kind
+
+
+class Profiler:
+    def __init__(self, callsite):
+        self.callsite = callsite    # gosub_stack entry -> line number of its GOSUB
+        self.lines = {}     # lineno -> [count, seconds]
+        self.kinds = {}     # statement kind -> [count, seconds]
+        self.stacks = {}    # (gosub_stack tuple, lineno) -> seconds
+
+    def add(self, lineno, kind, seconds, gosubs):
+        s = self.lines.get(lineno)
+        if s is None:
+            s = self.lines[lineno] = [0, 0.0]
+        s[0] += 1
+        s[1] += seconds
+        s = self.kinds.get(kind)
+        if s is None:
+            s = self.kinds[kind] = [0, 0.0]
+        s[0] += 1
+        s[1] += seconds
+        key = (gosubs, lineno)
+        self.stacks[key] = self.stacks.get(key, 0.0) + seconds
+
+    def total(self):
+        return sum(s[1] for s in self.lines.values())
+
+    def _table(self, head, rows, top):
+        total = self.total() or 1.0
+        out = [f"{head:>6} {'COUNT':>9} {'MS':>9} {'%':>5}"]
+        for key, (count, secs) in sorted(rows.items(), key=lambda kv: -kv[1][1])[:top]:
+            out.append(f"{key:>6} {count:>9} {secs * 1000:>9.2f} {secs / total * 100:>5.1f}")
+        return out
+
+    def hot_lines(self, top=10):
+        """Table of the lines that took the most time, as lines of text."""
+        return self._table('LINE', self.lines, top)
+
+    def hot_kinds(self, top=10):
+        return self._table('KIND', self.kinds, top)
+
+    def collapsed(self):
+        """Collapsed stacks ("main;L20;L110 123", microseconds) for flamegraph.pl and friends."""
+        merged = {}
+        for (gosubs, lineno), secs in self.stacks.items():
+            frames = ['main'] + [f"L{self.callsite(r)}" for r in gosubs] + [f"L{lineno}"]
+            key = ';'.join(frames)
+            merged[key] = merged.get(key, 0.0) + secs
+        return [f"{k} {round(v * 1e6)}" for k, v in sorted(merged.items())]
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            for line in self.collapsed():
+                f.write(line + '\n')
@@ -0,0 +1,136 @@
+import struct
+import zlib
+import numpy as np
+
+
+# -----------------------
+# PNG I/O (stdlib only)
+# -----------------------
+# Enough of PNG for the glyph sheet and frame dumps: 8-bit, non-interlaced
+# grey / RGB / RGBA images.
+PNG_SIG = b'\x89PNG\r\n\x1a\n'
+PNG_CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}     # colour type -> channels
+
+
+def _unfilter(raw, h, stride, bpp):
+    rows = np.frombuffer(raw, dtype=np.uint8).reshape(h, stride + 1)
+    out = np.zeros((h, stride), dtype=np.uint8)
+    prev = np.zeros(stride, dtype=np.int32)
+    for y in range(h):
+        kind, line = rows[y, 0], rows[y, 1:].astype(np.int32)
+        if kind == 0:
+            cur = line
+        elif kind == 2:
+            cur = (line + prev) & 0xff
+        else:
+            # Sub, Average and Paeth depend on the bytes just decoded
+            cur = np.zeros(stride, dtype=np.int32)
+            for i in range(stride):
+                a = cur[i - bpp] if i >= bpp else 0
+                b = prev[i]
+                if kind == 1:
+                    p = a
+                elif kind == 3:
+                    p = (a + b) >> 1
+                else:
+                    c = prev[i - bpp] if i >= bpp else 0
+                    pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - 2 * c)
+                    p = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+                cur[i] = (line[i] + p) & 0xff
+        out[y] = cur
+        prev = cur
+    return out
+
+
+def read_png(path):
+    """Load a PNG as an (h, w, channels) uint8 array."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:8] != PNG_SIG:
+        raise ValueError(f"{path}: not a PNG file")
+    pos, idat, header = 8, [], None
+    while pos < len(data):
+        n, kind = struct.unpack('>I4s', data[pos:pos+8])
+        body = data[pos+8:pos+8+n]
+        if kind == b'IHDR':
+            header = struct.unpack('>IIBBBBB', body)
+        elif kind == b'IDAT':
+            idat.append(body)
+        elif kind == b'IEND':
+            break
+        pos += 12 + n
+    w, h, depth, ctype, _, _, interlace = header
+    if depth != 8 or interlace or ctype not in PNG_CHANNELS:
+        raise ValueError(f"{path}: only 8-bit non-interlaced grey/RGB/RGBA PNGs are supported")
+    ch = PNG_CHANNELS[ctype]
+    pixels = _unfilter(zlib.decompress(b''.join(idat)), h, w * ch, ch)
+    return pixels.reshape(h, w, ch)
+
+
+def _chunk(kind, body):
+    return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+
+
+def write_png(path, pixels):
+    """Save an (h, w, 3) or (h, w, 4) uint8 array as a PNG."""
+    h, w, ch = pixels.shape
+    ctype = {1: 0, 3: 2, 4: 6}[ch]
+    raw = np.zeros((h, w * ch + 1), dtype=np.uint8)     # filter byte 0 on every row
+    raw[:, 1:] = pixels.reshape(h, w * ch)
+    with open(path, 'wb') as f:
+        f.write(PNG_SIG)
+        f.write(_chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, ctype, 0, 0, 0)))
+        f.write(_chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)))
+        f.write(_chunk(b'IEND', b''))
+
+
+# -----------------------
+# Software rasteriser
+# -----------------------
+# Same picture as display.frag: a 320x200 character area inside a border,
+# 8x8 glyphs from res/glyph.png (16x16 sheet), dark pixels are ink.
+FRAME_SIZE = (384, 272)
+MARGIN = (32, 36)
+PALETTE = np.array([[98, 78, 205],      # background, settings' c64 palette * 255
+                    [167, 146, 255]],   # border and ink
+                   dtype=np.uint8)
+# The 16 colours colour RAM selects ink from; blue and light blue are the
+# two above so an untouched screen looks the same either way
+COLOURS = np.array([[0, 0, 0], [255, 255, 255], [136, 57, 50], [103, 182, 189],
+                    [139, 63, 150], [85, 160, 73], PALETTE[0], [191, 206, 114],
+                    [139, 84, 41], [87, 66, 0], [184, 105, 98], [80, 80, 80],
+                    [120, 120, 120], [148, 224, 137], PALETTE[1], [159, 159, 159]],
+                   dtype=np.uint8)
+
+
+def load_glyphs(path='res/glyph.png'):
+    """(256, 8, 8) bool array, True where a glyph is inked."""
+    sheet = read_png(path)[..., 0] <= 127
+    return sheet.reshape(16, 8, 16, 8).transpose(0, 2, 1, 3).reshape(256, 8, 8)
+
+
+class Rasteriser:
+    """Draws a (40, 25) screen into an RGB frame (FRAME_SIZE[1], FRAME_SIZE[0], 3) in one indexing pass."""
+    def __init__(self, glyphs, palette=PALETTE, colours=COLOURS):
+        # every glyph pre-coloured: (256, 8, 8, 3), and in each ink: (16, 256, 8, 8, 3)
+        self.cells = palette[glyphs.astype(np.uint8)]
+        self.inked = np.where(glyphs[None, ..., None], colours[:, None, None, None], palette[0])
+        w, h = FRAME_SIZE
+        self.frame = np.empty((h, w, 3), dtype=np.uint8)
+        self.frame[:] = palette[1]
+        mx, my = MARGIN
+        # the character area, as (row, pixel row, column, pixel column, rgb)
+        self.area = self.frame[my:my + 200, mx:mx + 320].reshape(25, 8, 40, 8, 3)
+
+    def draw(self, screen, cursor=None, colours=None):
+        """Render screen (cursor is an (x, y) cell to reverse, colours a (40, 25) array of
+        ink colours); the returned frame is reused by the next call."""
+        codes = screen.T
+        if cursor is not None and 0 <= cursor[0] < 40 and 0 <= cursor[1] < 25:
+            codes = codes.copy()
+            codes[cursor[1], cursor[0]] ^= 128
+        if colours is None:
+            self.area[:] = self.cells[codes].transpose(0, 2, 1, 3, 4)
+        else:
+            self.area[:] = self.inked[colours.T & 15, codes].transpose(0, 2, 1, 3, 4)
+        return self.frame
@@ -0,0 +1,159 @@
+import time
+
+
+# -----------------------
+# Execution budgets
+# -----------------------
+# Programs run in slices whose size is counted in budget units. In 'authentic'
+# mode a unit is a CPU cycle: each statement is charged a rough C64 BASIC V2
+# cost and the scheduler hands out CPU_HZ cycles per second of wall time. In
+# 'turbo' mode a unit is one statement and slices are sized by time only.
+CPU_HZ = 1_000_000
+
+STMT_CYCLES = 300       # fetching the statement and dispatching on its keyword
+TOKEN_CYCLES = {        # per token, by kind
+    'NUMBER': 1000,     # literals are parsed to floats every time they run
+    'STRING': 200,
+    'NAME': 400,        # linear search of the variable table
+    'FUNC': 2500,
+    'OP': 600,
+    'BITWISE': 600,
+}
+KEYWORD_CYCLES = {      # extra for statements that do more than evaluate
+    'FOR': 1500, 'NEXT': 700, 'GOTO': 600, 'GOSUB': 900, 'RETURN': 700,
+    'IF': 200, 'PRINT': 1800, 'INPUT': 2000, 'READ': 900, 'DIM': 1500, 'POKE': 500,
+}
+
+TURBO_SLICE = 0.012     # seconds of each frame given to a turbo run
+MAX_FRAME = 0.1         # longer frames (window drags, breakpoints) aren't caught up on
+
+
+class Scheduler:
+    def __init__(self, mode='turbo', hz=CPU_HZ):
+        self.mode = mode    # 'authentic' or 'turbo'; read by RUN
+        self.hz = hz
+        self.reset()
+
+    def reset(self):
+        self.run_mode = self.mode
+        self.debt = 0       # units run past the last frame's allowance
+        self.chunk = 1000   # turbo slice size, retuned as the rate becomes known
+        self.executed = 0   # units used by the current run
+        self.elapsed = 0.0  # seconds spent on them
+
+    def cost(self, toks):
+        """Budget units charged for one statement."""
+        if self.run_mode == 'turbo':
+            return 1
+        kind = toks[0][0]
+        cycles = STMT_CYCLES + KEYWORD_CYCLES.get(kind, 0)
+        for t in toks:
+            cycles += TOKEN_CYCLES.get(t[0], 0)
+        return cycles
+
+    def rate(self):
+        """Units per second so far: statements/s in turbo, cycles/s in authentic mode."""
+        return self.executed / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        unit = 'STATEMENTS' if self.run_mode == 'turbo' else 'CYCLES'
+        return f"{self.executed} {unit} IN {self.elapsed:.3f}S ({self.rate():.0f}/S)"
+
+    def _slice(self, interp, budget):
+        more = interp.step(budget)
+        used = budget - interp.left
+        self.executed += used
+        return more, used
+
+    def frame(self, interp, dt, deadline=None):
+        """Give the running program its share of a frame that took dt seconds.
+
+        Turbo runs go on until deadline (a perf_counter() time), by default TURBO_SLICE from now."""
+        if not interp.running:
+            return False
+        if self.run_mode == 'authentic':
+            budget = int(min(dt, MAX_FRAME) * self.hz) - self.debt
+            if budget <= 0:
+                self.debt = -budget
+                self.elapsed += dt
+                return True
+            more, used = self._slice(interp, budget)
+            self.debt = max(used - budget, 0)
+            self.elapsed += dt
+            return more
+        start = time.perf_counter()
+        if deadline is None:
+            deadline = start + TURBO_SLICE
+        t = start
+        while True:
+            # at least one slice, even when the frame is already over
+            more, used = self._slice(interp, self.chunk)
+            now = time.perf_counter()
+            if now > t:
+                # aim for about 2ms per slice
+                self.chunk = max(int(used / (now - t) * 0.002), 100)
+            t = now
+            if not more or t >= deadline:
+                break
+        self.elapsed += t - start
+        return more
+
+    def run(self, interp):
+        """Run the program to its end, throttled to hz in authentic mode."""
+        start = time.perf_counter()
+        if self.run_mode == 'turbo':
+            try:
+                interp._run(None)
+            finally:
+                self.executed += (1 << 62) - interp.left
+                self.elapsed += time.perf_counter() - start
+            return
+        chunk = self.hz // 100
+        try:
+            while interp._run(chunk):
+                self.executed += chunk - interp.left
+                ahead = start + self.executed / self.hz - time.perf_counter()
+                if ahead > 0:
+                    time.sleep(ahead)
+            self.executed += chunk - interp.left
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+
+# -----------------------
+# Frame pacing
+# -----------------------
+class FrameScheduler:
+    """Paces the main loop to a target fps and keeps smoothed frame, render and interpreter times."""
+    def __init__(self, fps=60.0, smoothing=0.1):
+        self.period = 1.0 / fps
+        self.smoothing = smoothing
+        self.start = time.perf_counter()
+        self.times = {'frame': 0.0, 'render': 0.0, 'interp': 0.0}
+        self.rendered = 0
+        self.skipped = 0
+
+    def begin(self):
+        """Start a frame; returns the seconds since the previous one started."""
+        now = time.perf_counter()
+        dt, self.start = now - self.start, now
+        self.measure('frame', dt)
+        return dt
+
+    def measure(self, name, seconds):
+        self.times[name] += (seconds - self.times[name]) * self.smoothing
+
+    def deadline(self):
+        """When work for this frame has to stop to leave room for rendering."""
+        return self.start + self.period - self.times['render'] * 1.5 - 0.001
+
+    def wait(self):
+        """Sleep out the rest of the frame."""
+        left = self.start + self.period - time.perf_counter()
+        if left > 0:
+            time.sleep(left)
+
+    def report(self):
+        t = self.times
+        return (f"frame {t['frame'] * 1000:.1f}ms, render {t['render'] * 1000:.1f}ms, "
+                f"basic {t['interp'] * 1000:.1f}ms")
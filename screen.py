@@ -1,47 +1,150 @@
-from settings import *
+import numpy as np
+
+from memory import Memory, SCREEN_RAM, COLOUR_RAM, SCREEN_SIZE
+
+
+# Characters to screen codes: letters map to 1..26 (either case), the rest of
+# latin-1 keeps its code, anything beyond becomes '?'.
+SCREEN_CODES = {ord(c): i + 1 for i, c in enumerate('ABCDEFGHIJKLMNOPQRSTUVWXYZ')}
+SCREEN_CODES.update({ord(c): i + 1 for i, c in enumerate('abcdefghijklmnopqrstuvwxyz')})
+CLEAR = '\x93'  # CHR$(147)
+TEXT_COLOUR = 14    # light blue
 
 
 class Screen:
-    def __init__(self, app):
+    def __init__(self, app, memory=None):
         self.app = app
-        self.screen = np.full((40, 25), 32, dtype=np.uint8)
+        # cells and colours are views into screen and colour RAM. Rows live
+        # in a ring: logical row y is cells[(head + y) % 25], so scrolling
+        # just blanks the top row and advances head; normalise() puts them
+        # back in memory order for PEEK and POKE
+        self.memory = memory if memory is not None else Memory()
+        self.memory.screen = self
+        ram = self.memory.ram
+        self.cells = np.frombuffer(ram, np.uint8, SCREEN_SIZE, SCREEN_RAM).reshape(25, 40)
+        self.colours = np.frombuffer(ram, np.uint8, SCREEN_SIZE, COLOUR_RAM).reshape(25, 40)
+        self.colour = TEXT_COLOUR   # colour of newly written text
+        self.cells.fill(32)
+        self.colours.fill(self.colour)
+        self.head = 0
         self.cur_pos = [0, 6]
         self.current_input = ""
 
+        # Change tracking for the renderer: cells rows dirty_lo..dirty_hi-1
+        # changed since the last take_dirty(), generation counts every change
+        self.generation = 0
+        self.dirty_lo, self.dirty_hi = 0, 25
+
+        # screen and colour_screen gather the ring into these in reading
+        # order, once per generation; callers must not write to them
+        self._shown = np.empty((25, 40), np.uint8)
+        self._shown_colours = np.empty((25, 40), np.uint8)
+        self._shown_generation = -1
+
         self.write(4, 1, '**** COMMODORE 64 BASIC V2 ****', False)
         self.write(1, 3, '64K RAM SYSTEM  38911 BASIC BYTES FREE', False)
         self.write(0, 5, 'READY.', False)
 
-    def write(self, x, y, text, move_cursor=True):
-        for i, char in enumerate(text):
-            char = char.upper()
-            c=ord(char)
-            c = c-64 if c>64 and c<91 else c
-            if char == '\n': # New line
-                y += 1
-                self.cur_pos[1] += 1
-                self.cur_pos[0] = 0
-                continue
-            if c==147: # Clear Screen
-                self.screen = np.full((40, 25), 32, dtype=np.uint8)
-                self.cur_pos = [0, -1]
-                continue
-            if x+i > 39:
-                y += 1
-                self.cur_pos[1] += 1
-                self.cur_pos[0] = 0
-            else:
-                if move_cursor: self.cur_pos[0] += 1
-            if y>24:
-                self.scroll()
-                y -= 1
-            if self.cur_pos[1]>24:
-                self.scroll()
-            self.screen[x+i,y] = c
-            if move_cursor: self.current_input += char
-    
+    def _gather(self):
+        if self._shown_generation != self.generation:
+            rows = (np.arange(25) + self.head) % 25
+            np.take(self.cells, rows, 0, out=self._shown)
+            np.take(self.colours, rows, 0, out=self._shown_colours)
+            self._shown_generation = self.generation
+
+    @property
+    def screen(self):
+        """The screen in reading order as a (40, 25) array indexed [x, y]."""
+        self._gather()
+        return self._shown.T
+
+    @property
+    def colour_screen(self):
+        """Colours of the cells of screen, also indexed [x, y]."""
+        self._gather()
+        return self._shown_colours.T
+
+    def normalise(self):
+        """Rotate the ring so that row 0 is at the start of screen RAM."""
+        if self.head:
+            self.cells[:] = np.roll(self.cells, -self.head, 0)
+            self.colours[:] = np.roll(self.colours, -self.head, 0)
+            self.head = 0
+            self.touch(0, 25)
+
+    def touch(self, lo, hi):
+        """Mark cells rows lo..hi-1 as changed."""
+        self.dirty_lo = min(self.dirty_lo, lo)
+        self.dirty_hi = max(self.dirty_hi, hi)
+        self.generation += 1
+
+    def take_dirty(self):
+        """(lo, hi) range of cells rows changed since the last call, or None."""
+        if self.dirty_lo >= self.dirty_hi:
+            return None
+        rows = self.dirty_lo, self.dirty_hi
+        self.dirty_lo, self.dirty_hi = 25, 0
+        return rows
+
+    def clear(self):
+        self.cells.fill(32)
+        self.colours.fill(self.colour)
+        self.head = 0
+        self.cur_pos[:] = [0, 0]
+        self.touch(0, 25)
+
+    def write(self, x, y, text, move_cursor=True, capture=True):
+        """Put text on the screen from column x of row y, wrapping at 40 columns and scrolling at the bottom;
+        capture adds it to current_input, as typed text rather than program output."""
+        if move_cursor and capture:
+            self.current_input += text.replace('\n', '').replace(CLEAR, '')
+        if CLEAR in text:
+            self.clear()
+            x, y = 0, 0
+            text = text.rpartition(CLEAR)[2]
+        while y > 24:
+            self.scroll()
+            y -= 1
+        cells, colours = self.cells, self.colours
+        lo, hi = 25, 0
+        lines = text.split('\n')
+        if len(lines) > 25:
+            # every line but the last 25 scrolls off anyway
+            cells.fill(32)
+            colours.fill(self.colour)
+            lo, hi = 0, 25
+            lines = lines[-25:]
+            x, y = 0, 0
+        for n, line in enumerate(lines):
+            if n:
+                x, y = 0, y + 1
+            data = line.translate(SCREEN_CODES).encode('latin-1', 'replace')
+            while data:
+                if y > 24:
+                    self.scroll()
+                    y -= 1
+                k = min(40 - x, len(data))
+                row = (self.head + y) % 25
+                cells[row, x:x+k] = np.frombuffer(data, dtype=np.uint8, count=k)
+                colours[row, x:x+k] = self.colour
+                lo, hi = min(lo, row), max(hi, row + 1)
+                data = data[k:]
+                x += k
+                if x == 40:
+                    x, y = 0, y + 1
+        while y > 24:
+            self.scroll()
+            y -= 1
+        if lo < hi:
+            self.touch(lo, hi)
+        if move_cursor:
+            self.cur_pos[:] = [x, y]
+
     def scroll(self):
-        # Scroll screen
-        self.screen = np.roll(self.screen, -1, 1)
-        self.screen[:, -1] = 32
-        self.cur_pos[1] -= 1
\ No newline at end of file
+        # Scroll screen: the top row becomes the new bottom row
+        top = self.head
+        self.cells[top] = 32
+        self.colours[top] = self.colour
+        self.head = (top + 1) % 25
+        self.cur_pos[1] -= 1
+        self.touch(top, top + 1)
@@ -10,6 +10,7 @@ WIN_RES = glm.ivec2(384*SCALING, 272*SCALING)
 WIN_CENTER = int(WIN_RES.x//2), int(WIN_RES.y//2)
 FULLSCREEN = False
 FLAGS = (OPENGL | DOUBLEBUF | RESIZABLE) if not FULLSCREEN else (OPENGL | DOUBLEBUF | FULLSCREEN)
+SOFTWARE_RENDER = False  # draw with the NumPy rasteriser instead of OpenGL (no CRT effect)
 
 # camera
 ASPECT_RATIO = WIN_RES.x / WIN_RES.y
@@ -30,5 +31,8 @@ PITCH=-10
 ROLL=0
 MOUSE_SENSITIVITY = 0.006
 
+# interpreter
+BASIC_MODE = 'authentic'  # 'authentic' (C64 speed) or 'turbo' (as fast as Python goes)
+
 # colors
 BG_COLOR = glm.vec3(0.0, 0.0, 0.0)
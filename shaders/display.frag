@@ -5,9 +5,14 @@ out vec4 fragColor;
 
 uniform sampler2D Glyph;
 uniform vec3 Palette[2];
-uniform int Screen[1000];
+uniform usampler2D ScreenChars;  // 40x25 screen codes, rows in ring order
+uniform usampler2D ScreenColours; // colour RAM, same layout
+uniform vec3 Inks[16];
+uniform int Head;                // texture row holding screen row 0
 uniform ivec2 WinRes;
 uniform ivec2 Margin;
+uniform ivec2 Cursor;
+uniform bool CursorOn;
 
 void main() {
     const ivec2 SCR_SIZE = ivec2(40, 25);
@@ -32,8 +37,13 @@ void main() {
 
     // Which character?
     ivec2 pos = ivec2(scr_pos / char_size);
-    int index = (pos.x*SCR_SIZE.y) + (SCR_SIZE.y-pos.y-1);
-    int ch = Screen[index];
+    int row = (SCR_SIZE.y-pos.y-1 + Head) % SCR_SIZE.y;
+    int ch = int(texelFetch(ScreenChars, ivec2(pos.x, row), 0).r);
+    int ink = int(texelFetch(ScreenColours, ivec2(pos.x, row), 0).r) & 15;
+
+    // blinking cursor: the reversed half of the glyph sheet
+    if (CursorOn && ivec2(pos.x, SCR_SIZE.y-pos.y-1) == Cursor)
+        ch ^= 128;
 
     int gx = ch % 16;
     int gy = ch / 16;
@@ -57,5 +67,5 @@ void main() {
 
     float c = texture(Glyph, atlas_uv).r;
 
-    fragColor = vec4(Palette[c <= 0.5 ? 1 : 0], 1.0);
+    fragColor = vec4(c <= 0.5 ? Inks[ink] : Palette[0], 1.0);
 }
@@ -0,0 +1,710 @@
+import linecache
+import re
+
+from interpreter import to_rpn, parse_lvalue, parse_print, split_args, FUNC_TABLE, FUNCS
+from variables import var_kind, to_float, to_int, FLOAT, INT, STR
+
+
+# -----------------------
+# Python backend
+# -----------------------
+# The whole program becomes the source of one Python function, run(pc, n),
+# which compile() turns into CPython bytecode. Scalar variables are locals,
+# loaded from the Variables stores on entry and written back on the way out.
+# Every statement that something can jump to starts a labelled block, and a
+# while loop dispatches on pc with a binary tree of comparisons; n is the
+# budget, charged statement by statement and checked between blocks. An
+# innermost FOR ... NEXT whose body never jumps becomes a native while loop.
+# Statements with no translation (INPUT, READ, DIM ...) go to _exec_stmt,
+# with the variables they name synced around the call.
+PREFIX = {FLOAT: 'f_', INT: 'i_', STR: 's_'}   # local for A, A% and A$
+CONTROL = {'GOTO', 'GOSUB', 'RETURN', 'IFGO', 'FOR', 'NEXT'}   # what a native loop body can't hold
+COMPARE = {'=': '==', '<': '<', '>': '>', '<=': '<=', '>=': '>=', '<>': '!='}
+ARITH = {'+': '+', '-': '-', '*': '*', '/': '/', '^': '**'}
+FUNC_TYPES = {'INT': 'i', 'LEN': 'i', 'ASC': 'i'}    # always an int, even when they fail
+IDENT_RE = re.compile(r'[A-Za-z_]\w*$')
+
+
+def _safe(f):
+    # like compiled calls: a function that fails gives 0
+    def call(*args):
+        try:
+            return f(*args)
+        except Exception:
+            return 0
+    return call
+
+
+def _elem1(name, env):
+    arrays, get_elem = env.arrays, env.get_elem
+    def elem(k):
+        arr = arrays.get(name)
+        if arr is not None and arr.ndim == 1 and 0 <= k < arr.shape[0]:
+            return arr.item(int(k))
+        return get_elem(name, (k,))   # auto-DIM, BAD SUBSCRIPT
+    return elem
+
+
+def _to_str(v):
+    return str(v) if isinstance(v, float) else v
+
+
+def _drop_for(for_stack, var):
+    # FOR on a variable drops its pending loop and anything nested in it
+    for k in range(len(for_stack) - 1, -1, -1):
+        if for_stack[k][0] == var:
+            del for_stack[k:]
+            return
+
+
+def _ident(name):
+    return name.replace('$', '_s').replace('%', '_i')
+
+
+def _for_parts(toks):
+    """(var, start, end, step or None) token lists of a FOR statement."""
+    if toks[1][0] != 'NAME' or toks[2] != ('OP', '='):
+        raise SyntaxError("MALFORMED FOR")
+    var = toks[1][1]
+    if var.endswith(('$', '%')):
+        raise SyntaxError("MALFORMED FOR")
+    kinds = [t[0] for t in toks]
+    if 'TO' not in kinds:
+        raise SyntaxError("FOR WITHOUT TO")
+    to_idx = kinds.index('TO')
+    if 'STEP' in kinds:
+        step_idx = kinds.index('STEP')
+        return var, toks[3:to_idx], toks[to_idx+1:step_idx], toks[step_idx+1:]
+    return var, toks[3:to_idx], toks[to_idx+1:], None
+
+
+def _float(node):
+    # code for float(value) of an expression node
+    code, t, _ = node
+    if t == 'f':
+        return code
+    return code + '.0' if code.isdigit() else f'float({code})'
+
+
+def _next_var(toks):
+    return toks[1][1] if len(toks) > 1 and toks[1][0] == 'NAME' else None
+
+
+class _Stmt:
+    """One statement of the flattened program. IF ... THEN <statement> is two:
+    the IF, whose false condition skips to the next line, then the statement."""
+    __slots__ = ('lineno', 'line', 'toks', 'kind', 'cost', 'nested', 'skip')
+
+    def __init__(self, lineno, line, toks, cost, nested):
+        self.lineno = lineno
+        self.line = line
+        self.toks = toks
+        self.kind = toks[0][0]
+        self.cost = cost
+        self.nested = nested    # after THEN
+        self.skip = None        # IF: index of the next line's first statement
+
+
+def _flatten(interp):
+    cost = interp.scheduler.cost
+    stmts = []
+    line_start = {}     # lineno -> index of its first statement
+    for lineno, line in interp.lines_sorted:
+        line_start[lineno] = len(stmts)
+        ifs = []
+        for toks in line.stmts:
+            c = 0 if toks[0][0] in ('REM', 'DATA') else cost(toks)
+            nested = False
+            while True:
+                s = _Stmt(lineno, line, toks, c, nested)
+                stmts.append(s)
+                if s.kind != 'IF':
+                    break
+                kinds = [t[0] for t in toks]
+                if 'THEN' not in kinds:
+                    break
+                rest = toks[kinds.index('THEN')+1:]
+                if len(rest) == 1 and rest[0][0] == 'NUMBER':
+                    s.kind = 'IFGO'
+                    break
+                ifs.append(s)
+                if not rest:
+                    break
+                # what follows THEN was charged with the IF
+                toks, c, nested = rest, 0, True
+        for s in ifs:
+            s.skip = len(stmts)
+    return stmts, line_start
+
+
+# -----------------------
+# Code generator
+# -----------------------
+class Transpiler:
+    def __init__(self, interp):
+        self.interp = interp
+        self.env = interp.vars
+        self.stmts, self.line_start = _flatten(interp)
+        self.code = []      # (indent, text, lineno) of the function body
+        self.indent = 0
+        self.lineno = None  # BASIC line the code being emitted comes from
+        self.pending = 0    # cost of statements not charged to n yet
+        self.native = False     # inside a native loop body, charged per pass
+        self.locals = {}    # BASIC name -> (local, kind, slot)
+        self.loops = {}     # FOR index -> NEXT index, for native loops
+        self.resume = {}    # first body index -> FOR index
+        out, env, mem = interp.out, self.env, interp.memory
+        self.ns = {
+            'F': env.floats, 'I': env.ints, 'S': env.strs,
+            'R': {},    # native loop -> (end, step), kept across slices
+            'state': [0, 0],    # pc and budget left when run() returned
+            'interp': interp, 'exec_stmt': interp._exec_stmt,
+            'for_stack': interp.for_stack, 'gosub_stack': interp.gosub_stack,
+            'write': out.write, 'tab': out.tab, 'out_line': out.line,
+            'peek': mem.peek, 'poke': mem.poke,
+            'get_elem': env.get_elem, 'set_elem': env.set_elem,
+            'to_float': to_float, 'to_int': to_int, 'to_str': _to_str, 'drop_for': _drop_for,
+        }
+
+    # -----------------------
+    # Emitting
+    # -----------------------
+    def emit(self, text):
+        self.code.append((self.indent, text, self.lineno))
+
+    def charge(self):
+        if self.pending and not self.native:
+            self.emit(f'n -= {self.pending}')
+        self.pending = 0
+
+    def const(self, value):
+        name = f'c{len(self.ns)}'
+        self.ns[name] = value
+        return name
+
+    def local(self, name):
+        loc = self.locals.get(name)
+        if loc is None:
+            kind, i = self.env.slot(name)
+            loc = self.locals[name] = (PREFIX[kind] + name.rstrip('$%'), kind, i)
+        return loc[0]
+
+    def load(self, names):
+        """Locals for names, reread from the stores."""
+        for name in names:
+            loc, kind, i = self.locals[name]
+            self.emit(f'{loc} = {"FIS"[kind]}[{i}]')
+
+    def sync(self, names):
+        for name in names:
+            loc, kind, i = self.locals[name]
+            self.emit(f'{"FIS"[kind]}[{i}] = {loc}')
+
+    # -----------------------
+    # Expressions
+    # -----------------------
+    # A node is (code, type, cond): type is 'f', 'i' or 's' when the value is
+    # known to be a float, int or str, else None; cond, if not None, is
+    # cheaper code with the same truth value (a comparison without 1.0/0.0).
+    def rpn(self, line, toks):
+        key = tuple(toks)
+        rpn = line.parsed.get(key)
+        if rpn is None:
+            rpn = line.parsed[key] = to_rpn(toks)
+        return rpn
+
+    def expr(self, line, toks):
+        return self.node(self.rpn(line, toks))
+
+    def cond(self, line, toks):
+        code, _, cond = self.expr(line, toks)
+        return code if cond is None else cond
+
+    def node(self, rpn):
+        st = []
+        for typ, val in rpn:
+            if typ == 'NUMBER' or typ == 'STRING':
+                st.append((repr(val), {int: 'i', float: 'f', str: 's'}.get(type(val)), None))
+            elif typ == 'NAME':
+                kind = var_kind(val)
+                st.append((self.local(val), 'fis'[kind], None))
+            elif typ == 'FUNC':
+                args = [st.pop()[0] for _ in range(FUNCS[val])]
+                args.reverse()
+                if val == 'PEEK':
+                    st.append((f'peek({args[0]})', 'i', None))
+                elif val not in FUNC_TABLE:
+                    st.append(('None', None, None))
+                else:
+                    name = 'fn_' + _ident(val)
+                    self.ns.setdefault(name, _safe(FUNC_TABLE[val]))
+                    st.append((f'{name}({", ".join(args)})', FUNC_TYPES.get(val), None))
+            elif typ == 'ARRAY':
+                name, n = val
+                subs = [st.pop()[0] for _ in range(n)]
+                subs.reverse()
+                kind = var_kind(name)
+                if n == 1:
+                    fn = 'a_' + _ident(name)
+                    if fn not in self.ns:
+                        self.ns[fn] = _elem1(name, self.env)
+                    code = f'{fn}({subs[0]})'
+                else:
+                    code = f'get_elem({name!r}, [{", ".join(subs)}])'
+                st.append((code, 'fi'[kind] if kind != STR else None, None))
+            elif typ == 'COMMA':
+                continue
+            elif val == 'NEG':
+                a, t, _ = st.pop()
+                st.append((f'(-{a})', t if t in ('f', 'i') else None, None))
+            elif val == 'NOT':
+                a, _, ac = st.pop()
+                st.append((f'int(not {a})', 'i', f'(not {a if ac is None else ac})'))
+            else:
+                (b, bt, bc), (a, at, ac) = st.pop(), st.pop()
+                if val in ARITH:
+                    op = ARITH[val]
+                    if at == bt == 's' and val == '+':
+                        t = 's'
+                    elif at in ('f', 'i') and bt in ('f', 'i') and val != '^':
+                        t = 'f' if 'f' in (at, bt) or val == '/' else 'i'
+                    else:
+                        t = None
+                    st.append((f'({a} {op} {b})', t, None))
+                elif val in COMPARE:
+                    test = f'({a} {COMPARE[val]} {b})'
+                    st.append((f'(1.0 if {test} else 0.0)', 'f', test))
+                elif val in ('AND', 'OR'):
+                    op = val.lower()
+                    # int() keeps the truth of comparisons and ints, not of 0.5
+                    exact = (ac is not None or at == 'i') and (bc is not None or bt == 'i')
+                    cond = f'({a if ac is None else ac} {op} {b if bc is None else bc})' if exact else None
+                    st.append((f'int({a} {op} {b})', 'i', cond))
+                else:
+                    raise RuntimeError(f"Unknown operator: {val}")
+        return st[-1] if st else ('0.0', 'f', None)
+
+    # -----------------------
+    # Statements
+    # -----------------------
+    def stmt(self, k):
+        """Emit statement k; False when what follows it can't be reached from it."""
+        mark = len(self.code)
+        try:
+            return self._stmt(self.stmts[k], k)
+        except Exception as e:
+            # fail when reached, as the other engines do
+            del self.code[mark:]
+            self.emit(f'raise {self.const(e)}')
+            return False
+
+    def _stmt(self, s, k):
+        toks, kind, line = s.toks, s.kind, s.line
+        if kind in ('REM', 'DATA'):
+            return True
+        self.pending += s.cost
+        if kind == 'PRINT':
+            self.print_(line, toks[1:])
+            return True
+        if kind == 'LET':
+            toks = toks[1:]
+            kind = toks[0][0]
+        if len(toks) >= 2 and kind == 'NAME' and toks[1][0] == 'LPAREN':
+            name, subs, n = parse_lvalue(toks)
+            if n < len(toks) and toks[n] == ('OP', '='):
+                idx = ', '.join(self.expr(line, sub)[0] for sub in subs)
+                self.emit(f'set_elem({name!r}, ({idx},), {self.expr(line, toks[n+1:])[0]})')
+                return True
+        if len(toks) >= 3 and kind == 'NAME' and toks[1] == ('OP', '='):
+            self.let(toks[0][1], self.expr(line, toks[2:]))
+            return True
+        if kind == 'POKE':
+            args = split_args(toks[1:])
+            if len(args) != 2 or not all(args):
+                raise SyntaxError("SYNTAX")
+            self.emit(f'poke({self.expr(line, args[0])[0]}, {self.expr(line, args[1])[0]})')
+            return True
+        if kind in ('GOTO', 'GOSUB'):
+            target = int(toks[1][1])
+            self.charge()
+            if kind == 'GOSUB':
+                self.emit(f'gosub_stack.append({k + 1})')
+            self.emit(self.jump(target, f"{kind} TO UNKNOWN line"))
+            return False
+        if kind == 'RETURN':
+            self.charge()
+            self.emit('if not gosub_stack: raise RuntimeError("RETURN WITHOUT GOSUB")')
+            self.emit('pc = gosub_stack.pop(); continue')
+            return False
+        if kind == 'IF' or kind == 'IFGO':
+            kinds = [t[0] for t in toks]
+            if 'THEN' not in kinds:
+                raise SyntaxError("IF WITHOUT THEN")
+            then_idx = kinds.index('THEN')
+            cond = self.cond(line, toks[1:then_idx])
+            self.charge()
+            if kind == 'IFGO':
+                self.emit(f'if {cond}: {self.jump(int(toks[then_idx+1][1]), "IF THEN to unknown line")}')
+            elif s.skip is not None and s.skip > k + 1:
+                self.emit(f'if not {cond}: pc = {s.skip}; continue')
+            else:
+                self.emit(cond)     # THEN and nothing
+            return True
+        if kind == 'FOR':
+            self.for_(s, k)
+            return True
+        if kind == 'NEXT':
+            self.next_(s)
+            return True
+        if kind == 'RESTORE':
+            self.emit('interp.data_ptr = 0')
+            return True
+        if kind in ('END', 'STOP'):
+            self.charge()
+            self.emit('return False')
+            return False
+        if kind == 'NAME' or kind == 'NUMBER' or toks[0] == ('BITWISE', 'NOT'):
+            self.emit(f'out_line({self.expr(line, toks)[0]})')
+            return True
+        if kind in ('INPUT', 'READ', 'DIM'):
+            # parsed once, like the VM does; run by the interpreter's own code
+            targets = self.const(self.interp._targets(toks[1:], line))
+            self.fallback(s, f'interp._do_{kind}({targets})')
+            return True
+        self.fallback(s, f'exec_stmt({self.const(s.toks)}, {s.lineno})')
+        return True
+
+    def jump(self, target, msg):
+        dest = self.line_start.get(target)
+        if dest is None:
+            return f'raise {self.const(RuntimeError(f"{msg} {target}"))}'
+        return f'pc = {dest}; continue'
+
+    def let(self, name, node):
+        code, t, _ = node
+        loc = self.local(name)
+        kind = self.locals[name][1]
+        if kind == FLOAT:
+            code = _float(node) if t in ('f', 'i') else f'to_float({code})'
+        elif kind == INT:
+            code = f'to_int({code})'
+        elif t == 'f':
+            code = f'str({code})'
+        elif t not in ('s', 'i'):
+            code = f'to_str({code})'
+        self.emit(f'{loc} = {code}')
+
+    def print_(self, line, toks):
+        key = ('PRINT',) + tuple(toks)
+        parsed = line.parsed.get(key)
+        if parsed is None:
+            parsed = line.parsed[key] = parse_print(toks)
+        items, newline = parsed
+        # one write() for an item and the plain values after it, which can't
+        # fail or have side effects, so the output comes out in the same order
+        pieces = []
+        def flush():
+            if pieces:
+                self.emit(f'write({" + ".join(pieces)})')
+                pieces.clear()
+        for rpn in items:
+            if rpn is None:
+                flush()
+                self.emit('tab()')
+                continue
+            if len(rpn) == 1 and rpn[0][0] in ('STRING', 'NUMBER'):
+                pieces.append(repr(str(rpn[0][1])))
+                continue
+            plain = len(rpn) == 1 and rpn[0][0] == 'NAME'
+            if not plain:
+                flush()
+            code, t, _ = self.node(rpn)
+            if t in ('f', 'i'):
+                pieces.append(f'str({code})')
+                continue
+            if not IDENT_RE.match(code):
+                self.emit(f'v = {code}')
+                code = 'v'
+            pieces.append(f'({code} if {code}.__class__ is str else str({code}))')
+        if newline:
+            pieces.append(repr('\n'))
+        flush()
+
+    def for_(self, s, k):
+        var, start, end, step = _for_parts(s.toks)
+        line = s.line
+        loc = self.local(var)
+        # same order as FOR: the variable is set before step and end are evaluated
+        self.emit(f'{loc} = {_float(self.expr(line, start))}')
+        self.emit(f't = {_float(self.expr(line, step))}' if step else 't = 1.0')
+        self.emit(f'e = {_float(self.expr(line, end))}')
+        self.emit(f'drop_for(for_stack, {var!r})')
+        if k in self.loops:
+            self.emit(f'R[{k}] = (e, t)')
+        else:
+            self.emit(f'for_stack.append(({var!r}, e, t, {k + 1}))')
+
+    def next_(self, s):
+        var = _next_var(s.toks)
+        self.emit('if not for_stack: raise RuntimeError("NEXT WITHOUT FOR")')
+        self.emit('fv, fe, fs, fb = for_stack[-1]')
+        if var:
+            self.emit(f'if fv != {var!r}: raise RuntimeError("NEXT VARIABLE MISMATCH")')
+            v = self.local(var)
+            self.emit(f'{v} += fs')
+        else:
+            v = 'v'
+            for i, name in enumerate(self.for_vars):
+                loc = self.local(name)
+                self.emit(f'{"if" if i == 0 else "elif"} fv == {name!r}: {loc} += fs; v = {loc}')
+        self.charge()
+        self.emit(f'if (fs > 0 and {v} <= fe) or (fs < 0 and {v} >= fe): pc = fb; continue')
+        self.emit('for_stack.pop()')
+
+    def fallback(self, s, call):
+        # the statement's variables are the only ones the interpreter can see or set
+        names = [n for n in dict.fromkeys(t[1] for t in s.toks if t[0] == 'NAME') if n in self.locals]
+        self.sync(names)
+        self.emit(f'interp.cur_line = {self.const(s.line)}')
+        if not names:
+            self.emit(call)
+            return
+        self.emit('try:')
+        self.indent += 1
+        self.emit(call)
+        self.indent -= 1
+        self.emit('finally:')
+        self.indent += 1
+        self.load(names)
+        self.indent -= 1
+
+    # -----------------------
+    # Blocks and loops
+    # -----------------------
+    def find_loops(self, targets):
+        """Pair each innermost FOR with its NEXT when nothing jumps into or out of the body."""
+        stmts = self.stmts
+        for f, s in enumerate(stmts):
+            if s.kind != 'FOR' or s.nested:
+                continue
+            try:
+                var = _for_parts(s.toks)[0]
+            except Exception:
+                continue
+            ifs = []
+            for k in range(f + 1, len(stmts)):
+                t = stmts[k]
+                if k in targets:
+                    break
+                if t.kind == 'NEXT':
+                    if not t.nested and _next_var(t.toks) in (None, var) \
+                            and all(stmts[i].skip <= k for i in ifs):
+                        self.loops[f] = k
+                        self.resume[f + 1] = f
+                    break
+                if t.kind in CONTROL:
+                    break
+                if t.kind == 'IF' and t.skip is not None:
+                    ifs.append(k)
+
+    def labels(self):
+        stmts = self.stmts
+        targets = set()
+        for k, s in enumerate(stmts):
+            if s.kind in ('GOTO', 'GOSUB', 'IFGO'):
+                try:
+                    target = int(s.toks[-1][1]) if s.kind == 'IFGO' else int(s.toks[1][1])
+                except (IndexError, TypeError, ValueError):
+                    continue
+                if target in self.line_start:
+                    targets.add(self.line_start[target])
+                if s.kind == 'GOSUB':
+                    targets.add(k + 1)
+        self.find_loops(targets)
+        labels = targets | {0, len(stmts)} | set(self.resume)
+        inside = {k for f, n in self.loops.items() for k in range(f + 1, n + 1)}
+        for k, s in enumerate(stmts):
+            if k in inside:
+                continue
+            if s.kind == 'FOR' and k not in self.loops:
+                labels.add(k + 1)
+            elif s.kind == 'IF' and s.skip is not None:
+                labels.add(s.skip)
+        return sorted(labels)
+
+    def block(self, start, stop):
+        self.pending = 0
+        k = start
+        if k in self.resume:
+            f = self.resume[k]
+            self.loop(f)
+            k = self.loops[f] + 1
+        while k < stop:
+            self.lineno = self.stmts[k].lineno
+            if not self.stmt(k):
+                return
+            k += 1
+        self.charge()
+        self.emit(f'pc = {stop}; continue')
+
+    def loop(self, f):
+        nxt = self.loops[f]
+        stmts = self.stmts
+        self.lineno = stmts[f].lineno
+        loc = self.local(_for_parts(stmts[f].toks)[0])
+        cost = sum(s.cost for s in stmts[f + 1:nxt + 1])
+        self.emit(f'fe, fs = R[{f}]')
+        self.emit('while True:')
+        self.indent += 1
+        if cost:
+            self.emit(f'n -= {cost}')
+        self.native = True
+        self.body(f + 1, nxt)
+        self.native = False
+        self.pending = 0
+        self.lineno = stmts[nxt].lineno
+        self.emit(f'{loc} += fs')
+        self.emit(f'if not ((fs > 0 and {loc} <= fe) or (fs < 0 and {loc} >= fe)): break')
+        self.emit('if n <= 0: return True')     # out of time: the next slice comes back to this block
+        self.indent -= 1
+
+    def body(self, start, stop):
+        k = start
+        while k < stop:
+            s = self.stmts[k]
+            self.lineno = s.lineno
+            if s.kind != 'IF' or s.skip is None:
+                self.stmt(k)
+                k += 1
+                continue
+            # a false IF skips to the end of the line, inside the body
+            mark = len(self.code)
+            try:
+                kinds = [t[0] for t in s.toks]
+                cond = self.cond(s.line, s.toks[1:kinds.index('THEN')])
+            except Exception as e:
+                del self.code[mark:]
+                self.emit(f'raise {self.const(e)}')
+                k = s.skip
+                continue
+            self.emit(f'if {cond}:')
+            self.indent += 1
+            self.emit('pass')
+            self.body(k + 1, s.skip)
+            self.indent -= 1
+            k = s.skip
+
+    def tree(self, labels, bounds):
+        if len(labels) > 1:
+            mid = len(labels) // 2
+            self.lineno = None
+            self.emit(f'if pc < {labels[mid]}:')
+            self.indent += 1
+            self.tree(labels[:mid], bounds)
+            self.indent -= 1
+            self.lineno = None
+            self.emit('else:')
+            self.indent += 1
+            self.tree(labels[mid:], bounds)
+            self.indent -= 1
+            return
+        start = labels[0]
+        if start == len(self.stmts):
+            self.lineno = None
+            self.emit('return False')   # ran off the end
+        else:
+            self.block(start, bounds[start])
+
+    def translate(self):
+        """Source of run(pc, n) and the BASIC line of each of its lines."""
+        # every scalar the program names gets a local
+        for s in self.stmts:
+            toks = s.toks
+            for i, t in enumerate(toks):
+                if t[0] == 'NAME' and (i + 1 == len(toks) or toks[i+1][0] != 'LPAREN'):
+                    self.local(t[1])
+        self.for_vars = []
+        for s in self.stmts:
+            if s.kind == 'FOR':
+                try:
+                    var = _for_parts(s.toks)[0]
+                except Exception:
+                    continue
+                if var not in self.for_vars:
+                    self.for_vars.append(var)
+        labels = self.labels()
+        bounds = dict(zip(labels, labels[1:]))
+        self.indent = 3
+        self.tree(labels, bounds)
+        body = self.code
+        self.code = []
+        self.indent = 1
+        self.load(self.locals)
+        self.emit('try:')
+        self.indent = 2
+        self.emit('while n > 0:')
+        self.code += body
+        self.emit('return True')
+        self.indent = 1
+        self.emit('finally:')
+        self.indent = 2
+        self.sync(self.locals)
+        self.emit('state[0] = pc; state[1] = n')
+        src = ['def run(pc, n):'] + ['    ' * indent + text for indent, text, _ in self.code]
+        return '\n'.join(src) + '\n', [None] + [lineno for _, _, lineno in self.code]
+
+
+# -----------------------
+# Runner
+# -----------------------
+class PyProgram:
+    """A transpiled program, with the VM's interface: run() can stop after a budget and be resumed."""
+    counter = 0
+
+    def __init__(self, interp, source, linemap, ns, stmt_lines):
+        PyProgram.counter += 1
+        self.interp = interp
+        self.source = source
+        self.filename = f'<basic {PyProgram.counter}>'
+        self.linemap = linemap      # line of source - 1 -> BASIC line
+        self.stmt_lines = stmt_lines    # label -> BASIC line
+        self.state = ns['state']
+        linecache.cache[self.filename] = (len(source), None, source.splitlines(True), self.filename)
+        exec(compile(source, self.filename, 'exec'), ns)
+        self.fn = ns['run']
+        self.left = 0
+        self.error_line = None
+
+    def lineno(self):
+        """Line number of the statement that failed, or of the one up next."""
+        if self.error_line is not None:
+            return self.error_line
+        return self.stmt_lines[min(self.state[0], len(self.stmt_lines) - 1)]
+
+    def run(self, budget=None):
+        """Execute until budget scheduler units are used (or the end when None); True if the program isn't done."""
+        state = self.state
+        try:
+            more = self.fn(state[0], budget if budget is not None else 1 << 62)
+        except BaseException as e:
+            self.interp.running = False
+            tb = e.__traceback__
+            while tb is not None:
+                if tb.tb_frame.f_code is self.fn.__code__:
+                    self.error_line = self.linemap[tb.tb_lineno - 1]
+                tb = tb.tb_next
+            raise
+        finally:
+            self.left = state[1]
+        if not more:
+            self.interp.running = False
+        return more
+
+
+def transpile(interp):
+    """Translate interp.lines_sorted into a PyProgram."""
+    t = Transpiler(interp)
+    source, linemap = t.translate()
+    last = interp.lines_sorted[-1][0] if interp.lines_sorted else None
+    stmt_lines = [s.lineno for s in t.stmts] + [last]
+    return PyProgram(interp, source, linemap, t.ns, stmt_lines)
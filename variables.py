@@ -0,0 +1,165 @@
+from array import array
+import numpy as np
+import math
+
+
+# -----------------------
+# Variable storage
+# -----------------------
+# Names are resolved to (kind, index) slots once, at compile time. Each kind
+# lives in its own compact store: reals in array('d'), A% integers in
+# array('h') and A$ strings in a plain list.
+FLOAT, INT, STR = 0, 1, 2
+
+ARRAY_DTYPES = {FLOAT: np.float64, INT: np.int16, STR: object}
+
+
+def var_kind(name):
+    if name.endswith('$'):
+        return STR
+    if name.endswith('%'):
+        return INT
+    return FLOAT
+
+
+def to_float(v):
+    if isinstance(v, str):
+        try:
+            return float(v)
+        except ValueError:
+            return 0.0
+    return float(v)
+
+
+def to_int(v):
+    v = math.floor(to_float(v))
+    if not -32768 <= v <= 32767:
+        raise RuntimeError("ILLEGAL QUANTITY")
+    return v
+
+
+class Variables:
+    def __init__(self):
+        self.floats = array('d')
+        self.ints = array('h')
+        self.strs = []
+        self.stores = (self.floats, self.ints, self.strs)
+        self.slots = {}     # name -> (kind, index into its store)
+        self.arrays = {}    # name -> numpy array, created by DIM or on first use
+        self.memory = None  # Memory that PEEK reads, set by the interpreter
+
+    def slot(self, name):
+        """(kind, index) for a scalar variable, allocating it on first sight."""
+        s = self.slots.get(name)
+        if s is None:
+            kind = var_kind(name)
+            store = self.stores[kind]
+            store.append('' if kind == STR else 0)
+            s = self.slots[name] = (kind, len(store) - 1)
+        return s
+
+    def clear(self):
+        # values are reset in place: compiled code keeps its slots and store references
+        self.floats[:] = array('d', bytes(8 * len(self.floats)))
+        self.ints[:] = array('h', bytes(2 * len(self.ints)))
+        self.strs[:] = [''] * len(self.strs)
+        self.arrays.clear()
+
+    def setter(self, name, value):
+        """Closure that assigns the result of value() to name, converting it like LET."""
+        kind, i = self.slot(name)
+        store = self.stores[kind]
+        if kind == FLOAT:
+            def let():
+                v = value()
+                try:
+                    store[i] = v
+                except TypeError:
+                    store[i] = to_float(v)
+        elif kind == INT:
+            def let():
+                store[i] = to_int(value())
+        else:
+            def let():
+                v = value()
+                store[i] = str(v) if isinstance(v, float) else v
+        return let
+
+    def assign(self, name, v):
+        """Assign with LET's conversions (strings to numbers, reals to text)."""
+        kind, i = self.slot(name)
+        if kind == FLOAT:
+            self.floats[i] = to_float(v)
+        elif kind == INT:
+            self.ints[i] = to_int(v)
+        else:
+            self.strs[i] = str(v) if isinstance(v, float) else v
+
+    # dict-style access, as used by the reference engine and eval_rpn
+    def get(self, name, default=None):
+        s = self.slots.get(name)
+        if s is None:
+            return default
+        return self.stores[s[0]][s[1]]
+
+    def __getitem__(self, name):
+        s = self.slots.get(name)
+        if s is None:
+            raise KeyError(name)
+        return self.stores[s[0]][s[1]]
+
+    def __setitem__(self, name, v):
+        kind, i = self.slot(name)
+        self.stores[kind][i] = to_int(v) if kind == INT else v
+
+    def __contains__(self, name):
+        return name in self.slots
+
+    # -----------------------
+    # Arrays
+    # -----------------------
+    def dim(self, name, bounds):
+        """DIM name(b1, b2, ...): each subscript runs 0..b inclusive."""
+        if name in self.arrays:
+            raise RuntimeError("REDIM'D ARRAY")
+        shape = tuple(int(b) + 1 for b in bounds)
+        if min(shape) < 1:
+            raise RuntimeError("BAD SUBSCRIPT")
+        kind = var_kind(name)
+        arr = np.zeros(shape, dtype=ARRAY_DTYPES[kind])
+        if kind == STR:
+            arr.fill('')
+        self.arrays[name] = arr
+        return arr
+
+    def array(self, name, ndim):
+        """The array called name; first use without DIM gives 0..10 in every dimension."""
+        arr = self.arrays.get(name)
+        if arr is None:
+            arr = self.dim(name, (10,) * ndim)
+        elif arr.ndim != ndim:
+            raise RuntimeError("BAD SUBSCRIPT")
+        return arr
+
+    def index(self, arr, subs):
+        idx = tuple(int(s) for s in subs)
+        for i, n in zip(idx, arr.shape):
+            if not 0 <= i < n:
+                raise RuntimeError("BAD SUBSCRIPT")
+        return idx
+
+    def get_elem(self, name, subs):
+        arr = self.array(name, len(subs))
+        v = arr[self.index(arr, subs)]
+        return v if arr.dtype == object else v.item()
+
+    def set_elem(self, name, subs, v):
+        arr = self.array(name, len(subs))
+        kind = var_kind(name)
+        if kind == FLOAT:
+            v = to_float(v)
+        elif kind == INT:
+            v = to_int(v)
+        elif isinstance(v, float):
+            v = str(v)
+        arr[self.index(arr, subs)] = v
@@ -0,0 +1,655 @@
+
+
+import time
+import numpy as np
+
+from interpreter import to_rpn, parse_lvalue, FUNCS
+from variables import var_kind, INT, STR
+from profiler import stmt_kind
+
+
+# -----------------------
+# Instruction set
+# -----------------------
+# Every instruction is an (op, a, b) tuple. Straight-line statements are
+# compiled to closures and run through EXEC; only control flow gets its own
+# opcode, with jump targets already resolved to instruction indices.
+EXEC, JUMP, IF_TRUE, IF_FALSE, GOSUB, RETURN, FOR, NEXT, END = range(9)
+
+
+class Program:
+    """A compiled BASIC program: flat code plus the map back to line numbers."""
+    def __init__(self):
+        self.code = []
+        self.lines = []     # pc -> lineno
+        self.src = []       # pc -> tokens of the statement it was compiled from
+        self.cost = []      # pc -> scheduler units, charged on a statement's first instruction
+        self.line_pc = {}   # lineno -> pc of its first instruction
+        self.clock = [0]    # instructions left in the current slice, shared with fused loops
+
+    def emit(self, lineno, op, a=None, b=None):
+        self.code.append((op, a, b))
+        self.lines.append(lineno)
+        self.src.append(None)
+        self.cost.append(0)
+        return len(self.code) - 1
+
+    def patch(self, pc, target):
+        op, a, _ = self.code[pc]
+        self.code[pc] = (op, a, target)
+
+
+def _raiser(exc):
+    def raise_():
+        raise exc
+    return raise_
+
+
+# -----------------------
+# Compiler: program lines -> flat code
+# -----------------------
+class Compiler:
+    def __init__(self, interp):
+        self.interp = interp
+        self.prog = Program()
+        self.line = None    # ProgramLine being compiled; its cache holds the expressions
+        self.fixups = []    # (pc, target lineno, error message)
+        self.line_end = []  # pcs that jump to the start of the next line
+
+    def compile(self):
+        prog = self.prog
+        cost = self.interp.scheduler.cost
+        for lineno, line in self.interp.lines_sorted:
+            prog.line_pc[lineno] = len(prog.code)
+            self.line = line
+            for toks in line.stmts:
+                start = len(prog.code)
+                try:
+                    self.stmt(lineno, toks)
+                except Exception as e:
+                    # keep the reference engine's behaviour: fail when reached
+                    prog.emit(lineno, EXEC, _raiser(e))
+                prog.src[start:] = [toks] * (len(prog.code) - start)
+                if len(prog.code) > start:
+                    prog.cost[start] = cost(toks)
+            for pc in self.line_end:
+                prog.patch(pc, len(prog.code))
+            self.line_end.clear()
+        prog.emit(None, END)
+        # unknown jump targets land on a trap that raises when taken
+        for pc, target, msg in self.fixups:
+            dest = prog.line_pc.get(target)
+            if dest is None:
+                dest = prog.emit(prog.lines[pc], EXEC, _raiser(RuntimeError(f"{msg} {target}")))
+            prog.patch(pc, dest)
+        fuse_loops(prog, self.interp)
+        return prog
+
+    def expr(self, toks):
+        return self.line.expr(toks, self.interp.vars)
+
+    def jump(self, lineno, op, a, target, msg):
+        pc = self.prog.emit(lineno, op, a)
+        self.fixups.append((pc, target, msg))
+
+    def stmt(self, lineno, toks):
+        interp = self.interp
+        emit = self.prog.emit
+        kind = toks[0][0]
+        if kind in ('REM', 'DATA'):
+            return
+        if kind == 'PRINT':
+            emit(lineno, EXEC, self.print_stmt(toks[1:]))
+            return
+        if kind == 'LET':
+            toks = toks[1:]
+            kind = toks[0][0]
+        if len(toks) >= 2 and kind == 'NAME' and toks[1][0] == 'LPAREN':
+            name, subs, n = parse_lvalue(toks)
+            if n < len(toks) and toks[n] == ('OP', '='):
+                emit(lineno, EXEC, self.elem_setter(name, subs, toks[n+1:]))
+                return
+        if len(toks) >= 3 and kind == 'NAME' and toks[1] == ('OP', '='):
+            emit(lineno, EXEC, interp.vars.setter(toks[0][1], self.expr(toks[2:])))
+            return
+        if kind == 'INPUT':
+            targets = interp._targets(toks[1:], self.line)
+            emit(lineno, EXEC, lambda: interp._do_INPUT(targets))
+            return
+        if kind == 'DIM':
+            targets = interp._targets(toks[1:], self.line)
+            emit(lineno, EXEC, lambda: interp._do_DIM(targets))
+            return
+        if kind == 'POKE':
+            addr, value = interp._poke_args(toks[1:], self.line)
+            poke = interp.memory.poke
+            emit(lineno, EXEC, lambda: poke(addr(), value()))
+            return
+        if kind == 'GOTO':
+            self.jump(lineno, JUMP, None, int(toks[1][1]), "GOTO TO UNKNOWN line")
+            return
+        if kind == 'GOSUB':
+            self.jump(lineno, GOSUB, None, int(toks[1][1]), "GOSUB TO UNKNOWN line")
+            return
+        if kind == 'RETURN':
+            emit(lineno, RETURN)
+            return
+        if kind == 'IF':
+            kinds = [t[0] for t in toks]
+            if 'THEN' not in kinds:
+                raise SyntaxError("IF WITHOUT THEN")
+            then_idx = kinds.index('THEN')
+            cond = self.expr(toks[1:then_idx])
+            rest = toks[then_idx+1:]
+            if len(rest) == 1 and rest[0][0] == 'NUMBER':
+                self.jump(lineno, IF_TRUE, cond, int(rest[0][1]), "IF THEN to unknown line")
+            else:
+                # IF ... THEN <statement>: a false condition skips the rest of the line
+                self.line_end.append(emit(lineno, IF_FALSE, cond))
+                if rest:    # IF A THEN with nothing after is a no-op, as on the py engine
+                    self.stmt(lineno, rest)
+            return
+        if kind == 'FOR':
+            emit(lineno, FOR, self.for_stmt(toks))
+            return
+        if kind == 'NEXT':
+            var = toks[1][1] if len(toks) > 1 and toks[1][0] == 'NAME' else None
+            emit(lineno, NEXT, var)
+            return
+        if kind == 'READ':
+            targets = interp._targets(toks[1:], self.line)
+            emit(lineno, EXEC, lambda: interp._do_READ(targets))
+            return
+        if kind == 'RESTORE':
+            def restore():
+                interp.data_ptr = 0
+            emit(lineno, EXEC, restore)
+            return
+        if kind in ('END', 'STOP'):
+            emit(lineno, END)
+            return
+        if kind == 'NAME' or kind == 'NUMBER' or toks[0] == ('BITWISE', 'NOT'):
+            value = self.expr(toks)
+            emit(lineno, EXEC, lambda: interp.out.line(value()))
+            return
+        raise SyntaxError("Unknown statement: " + ' '.join(str(t[1]) for t in toks))
+
+    def elem_setter(self, name, subs, value_toks):
+        set_elem = self.interp.vars.set_elem
+        idx = [self.expr(s) for s in subs]
+        value = self.expr(value_toks)
+        if len(idx) == 1:
+            s, = idx
+            return lambda: set_elem(name, (s(),), value())
+        return lambda: set_elem(name, [f() for f in idx], value())
+
+    def print_stmt(self, toks):
+        items, newline = self.line.print_items(toks, self.interp.vars)
+        print_ = self.interp._print
+        return lambda: print_(items, newline)
+
+    def for_stmt(self, toks):
+        # FOR A = 1 TO 10 STEP 2
+        if toks[1][0] != 'NAME' or toks[2] != ('OP', '='):
+            raise SyntaxError("MALFORMED FOR")
+        var = toks[1][1]
+        if var.endswith(('$', '%')):
+            raise SyntaxError("MALFORMED FOR")
+        kinds = [t[0] for t in toks]
+        if 'TO' not in kinds:
+            raise SyntaxError("FOR WITHOUT TO")
+        to_idx = kinds.index('TO')
+        start = self.expr(toks[3:to_idx])
+        if 'STEP' in kinds:
+            step_idx = kinds.index('STEP')
+            end = self.expr(toks[to_idx+1:step_idx])
+            step = self.expr(toks[step_idx+1:])
+        else:
+            end = self.expr(toks[to_idx+1:])
+            step = None
+        env = self.interp.vars
+        store, i = env.floats, env.slot(var)[1]
+
+        def init():
+            store[i] = float(start())
+            fstep = float(step()) if step else 1.0
+            return var, float(end()), fstep, store, i
+        return init
+
+
+# -----------------------
+# Loop fusion
+# -----------------------
+# FOR I=a TO b : A(I)=expr : NEXT fills and copies run as one NumPy operation.
+# The fused FOR keeps the plain loop code right behind it and falls back to it
+# whenever the vector path could differ (non-integer steps, bad subscripts,
+# overflow, 1/0 ...), so errors and partial results match the plain loop.
+class _NoFast(Exception):
+    pass
+
+# Only operations NumPy rounds exactly like the scalar path: its sin, exp,
+# power ... can be an ulp off math's, so those keep the plain loop. The + 0.0
+# turns the -0.0 of floor and sign into the 0 that math.floor and SGN give.
+VEC_BINOPS = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.divide}
+VEC_COMPARE = {'=': np.equal, '<': np.less, '>': np.greater,
+               '<=': np.less_equal, '>=': np.greater_equal, '<>': np.not_equal}
+VEC_FUNCS = {'ABS': np.abs, 'INT': lambda v: np.floor(v) + 0.0,
+             'SGN': lambda v: np.sign(v) + 0.0, 'SQR': np.sqrt}
+
+
+def _vec_index(v, n, size):
+    v = np.broadcast_to(np.asarray(v, dtype=np.float64), (n,))
+    if not np.isfinite(v).all():
+        raise _NoFast
+    idx = v.astype(np.int64)    # truncates like int()
+    if idx.min() < 0 or idx.max() >= size:
+        raise _NoFast
+    return idx
+
+
+def _vec_gather(name, subs, env):
+    arrays = env.arrays
+    def gather(iv):
+        arr = arrays.get(name)
+        if arr is None or arr.ndim != len(subs) or arr.dtype == object:
+            raise _NoFast   # auto-DIM and type errors are the plain loop's business
+        n = len(iv)
+        idx = tuple(_vec_index(s(iv), n, size) for s, size in zip(subs, arr.shape))
+        return arr[idx].astype(np.float64)
+    return gather
+
+
+def compile_vector(rpn, var, env, target):
+    """Compile an RPN expression to a function of the loop-variable vector, or None.
+
+    Returns (fn, is_loop_var); fn(iv) gives an array or a scalar.
+    """
+    st = []
+    for typ, val in rpn:
+        if typ == 'NUMBER':
+            st.append((lambda iv, v=float(val): v, False))
+        elif typ == 'NAME':
+            if val == var:
+                st.append((lambda iv: iv, True))
+            elif var_kind(val) == STR:
+                return None
+            else:
+                kind, i = env.slot(val)
+                store = env.stores[kind]
+                st.append((lambda iv, store=store, i=i: store[i], False))
+        elif typ == 'ARRAY':
+            name, n = val
+            if name == target or var_kind(name) == STR:
+                return None     # a recurrence like A(I)=A(I-1) has to run in order
+            subs = [st.pop()[0] for _ in range(n)]
+            subs.reverse()
+            st.append((_vec_gather(name, subs, env), False))
+        elif typ == 'FUNC':
+            if val not in VEC_FUNCS or FUNCS[val] != 1:
+                return None
+            a = st.pop()[0]
+            st.append((lambda iv, f=VEC_FUNCS[val], a=a: f(a(iv)), False))
+        elif typ == 'OP' and val == 'NEG':
+            a = st.pop()[0]
+            st.append((lambda iv, a=a: np.negative(a(iv)), False))
+        elif typ == 'OP' and (val in VEC_BINOPS or val in VEC_COMPARE):
+            b, a = st.pop()[0], st.pop()[0]
+            if val in VEC_BINOPS:
+                fn = lambda iv, f=VEC_BINOPS[val], a=a, b=b: f(a(iv), b(iv))
+            else:
+                fn = lambda iv, f=VEC_COMPARE[val], a=a, b=b: np.where(f(a(iv), b(iv)), 1.0, 0.0)
+            st.append((fn, False))
+        elif typ == 'COMMA':
+            continue
+        else:
+            return None
+    return st[-1] if len(st) == 1 else None
+
+
+def vector_fill(toks, var, env):
+    """fill(start, step, n) for a body like A(I)=expr, or None if it can't be vectorized."""
+    if toks and toks[0][0] == 'LET':
+        toks = toks[1:]
+    if len(toks) < 2 or toks[0][0] != 'NAME' or toks[1][0] != 'LPAREN':
+        return None
+    try:
+        target, subs, n = parse_lvalue(toks)
+        if n >= len(toks) or toks[n] != ('OP', '=') or var_kind(target) == STR:
+            return None
+        vsubs = [compile_vector(to_rpn(s), var, env, target) for s in subs]
+        value = compile_vector(to_rpn(toks[n+1:]), var, env, target)
+    except Exception:
+        return None
+    if value is None or None in vsubs:
+        return None
+    value = value[0]
+    # subscripts that are the loop variable itself can't repeat
+    distinct = any(is_var for _, is_var in vsubs)
+    vsubs = [f for f, _ in vsubs]
+    is_int = var_kind(target) == INT
+
+    def fill(start, step, n):
+        arr = env.array(target, len(vsubs))     # auto-DIM exactly as the first store would
+        if n > arr.size:
+            raise _NoFast   # some element is written twice or out of range
+        iv = start + step * np.arange(n, dtype=np.float64)
+        with np.errstate(all='ignore'):
+            idx = tuple(_vec_index(s(iv), n, size) for s, size in zip(vsubs, arr.shape))
+            vals = np.broadcast_to(np.asarray(value(iv), dtype=np.float64), (n,))
+        if not np.isfinite(vals).all():
+            raise _NoFast
+        if is_int:
+            vals = np.floor(vals)
+            if vals.min() < -32768 or vals.max() > 32767:
+                raise _NoFast
+        if not distinct and len(np.unique(np.ravel_multi_index(idx, arr.shape))) != n:
+            raise _NoFast
+        arr[idx] = vals
+    return fill
+
+
+def _trips(start, end, step):
+    # iterations of an integral FOR loop; the body always runs at least once
+    if step > 0:
+        return int((end - start) // step) + 1 if end >= start else 1
+    return int((start - end) // -step) + 1 if start >= end else 1
+
+
+def _vector_for(init, fill, clock, cost):
+    def fused():
+        frame = init()
+        _, end, step, store, i = frame
+        start = store[i]
+        if step == 0 or not (start.is_integer() and step.is_integer()):
+            return frame
+        n = _trips(start, end, step)
+        try:
+            fill(start, step, n)
+        except _NoFast:
+            return frame
+        store[i] = start + n * step
+        clock[0] -= n * cost
+        return n
+    return fused
+
+
+# A loop whose body never jumps out of it runs as a native Python loop over
+# the body's closures. A fused FOR returns how many iterations it ran
+# instead of a frame, and the VM continues after the matching NEXT.
+# Native loops charge the slice clock as they go; when it runs out they raise
+# _Suspend with the FOR frames a plain run would have at that point, and the
+# VM picks the loop up again in the plain code.
+class _Suspend(Exception):
+    def __init__(self, frames, pc):
+        self.frames = frames
+        self.pc = pc
+
+def _cond(cond, body):
+    if len(body) == 1:
+        f, = body
+        def cond1():
+            if cond():
+                f()
+        return cond1
+    def cond_block():
+        if cond():
+            for f in body:
+                f()
+    return cond_block
+
+
+def _native_for(init, body, for_stack, clock, body_pc, cost):
+    def loop():
+        frame = init()
+        if frame.__class__ is int:
+            return frame    # the vector path did it
+        var, end, step, store, i = frame
+        # like FOR, drop a pending loop on the same variable
+        for k in range(len(for_stack) - 1, -1, -1):
+            if for_stack[k][0] == var:
+                del for_stack[k:]
+                break
+        if not body:
+            # empty delay loop: fold it, only its iteration count is left
+            start = store[i]
+            if step != 0 and start.is_integer() and step.is_integer():
+                n = _trips(start, end, step)
+                if n * cost < clock[0]:
+                    store[i] = start + n * step
+                    clock[0] -= n * cost
+                    return n
+        f = body[0] if len(body) == 1 else None
+        n = 0
+        while True:
+            try:
+                if f is not None:
+                    f()
+                else:
+                    for g in body:
+                        g()
+            except _Suspend as s:
+                s.frames.insert(0, frame + (body_pc,))
+                raise
+            n += 1
+            v = store[i] + step
+            store[i] = v
+            if not ((step > 0 and v <= end) or (step < 0 and v >= end)):
+                clock[0] -= cost
+                return n
+            clock[0] -= cost
+            if clock[0] <= 0:
+                raise _Suspend([frame + (body_pc,)], body_pc)
+    return loop
+
+
+def _block(prog, lo, hi, loops):
+    # closures for code[lo:hi] and what one pass costs, or None if it
+    # contains control flow a native loop can't take
+    code = prog.code
+    body = []
+    cost = 0
+    k = lo
+    while k < hi:
+        op, a, b = code[k]
+        cost += prog.cost[k]
+        if op == EXEC:
+            body.append(a)
+            k += 1
+        elif op == IF_FALSE and k < b <= hi:
+            inner = _block(prog, k + 1, b, loops)
+            if inner is None:
+                return None
+            body.append(_cond(a, inner[0]))
+            cost += inner[1]
+            k = b
+        elif op == FOR and k in loops:
+            body.append(loops[k][0])    # charges its own iterations
+            k = loops[k][1] + 1
+        else:
+            return None
+    return body, cost
+
+
+def fuse_loops(prog, interp):
+    """Replace FOR ... NEXT loops in prog.code with vectorized or native loops where possible."""
+    code = prog.code
+    env = interp.vars
+    jumps = [(pc, b) for pc, (op, _, b) in enumerate(code) if op in (JUMP, IF_TRUE, IF_FALSE, GOSUB)]
+
+    # pair each FOR with the NEXT that closes it in program order
+    pairs = []
+    open_fors = []
+    for pc, (op, a, _) in enumerate(code):
+        if op == FOR:
+            var = prog.src[pc][1][1]
+            if prog.src[pc][0][0] != 'FOR' or any(prog.src[f][1][1] == var for f in open_fors):
+                # IF ... THEN FOR, or a FOR that drops a loop it sits in: leave the surrounding loops alone
+                open_fors.clear()
+            else:
+                open_fors.append(pc)
+        elif op == NEXT and open_fors:
+            f = open_fors.pop()
+            if a in (None, prog.src[f][1][1]):
+                pairs.append((f, pc))
+            else:
+                open_fors.clear()
+
+    # FOR / A(I)=expr / NEXT first, then native loops from the innermost out
+    loops = {}  # FOR pc -> (runner, NEXT pc)
+    for f, n in sorted(pairs, key=lambda p: p[1] - p[0]):
+        if any(f < t <= n and not f < pc < n for pc, t in jumps):
+            continue    # something jumps into the body
+        var = prog.src[f][1][1]
+        init = code[f][1]
+        if n == f + 2 and code[f+1][0] == EXEC:
+            fill = vector_fill(prog.src[f+1], var, env)
+            if fill is not None:
+                init = _vector_for(init, fill, prog.clock, prog.cost[f+1] + prog.cost[n])
+        block = _block(prog, f + 1, n, loops)
+        if block is None:
+            if init is not code[f][1]:
+                code[f] = (FOR, init, n + 1)
+            continue
+        body, cost = block
+        loops[f] = (_native_for(init, body, interp.for_stack, prog.clock, f + 1, cost + prog.cost[n]), n)
+        code[f] = (FOR, loops[f][0], n + 1)
+
+
+def compile_program(interp):
+    """Compile interp.lines_sorted into a flat Program."""
+    return Compiler(interp).compile()
+
+
+# -----------------------
+# Dispatch loop
+# -----------------------
+class VM:
+    """Runs a Program. run() can stop after a budget of instructions and be resumed."""
+    def __init__(self, interp, program):
+        self.interp = interp
+        self.program = program
+        self.pc = 0
+        self.left = 0   # budget left when run() returned
+        self.failed = None  # pc of the instruction that raised, if one did
+        self.kinds = None   # pc -> profile bucket, built by the first profile()
+
+    def lineno(self):
+        """Line number of the instruction that failed, or else of the one up next."""
+        lines = self.program.lines
+        # pc - 1 is only where we came from after a jump
+        pc = self.failed if self.failed is not None else self.pc
+        while pc > 0 and lines[pc] is None:
+            pc -= 1
+        return lines[pc]
+
+    def run(self, budget=None):
+        """Execute until budget scheduler units are used (or the end when None); True if the program isn't done."""
+        interp = self.interp
+        code = self.program.code
+        cost = self.program.cost
+        clock = self.program.clock
+        for_stack = interp.for_stack
+        gosub_stack = interp.gosub_stack
+        pc = self.pc
+        n = budget if budget is not None else 1 << 62
+        done = False
+        try:
+            while n > 0:
+                op, a, b = code[pc]
+                n -= cost[pc]
+                pc += 1
+                if op == EXEC:
+                    a()
+                elif op == NEXT:
+                    if not for_stack:
+                        raise RuntimeError("NEXT WITHOUT FOR")
+                    fvar, fend, fstep, store, i, body = for_stack[-1]
+                    if a and a != fvar:
+                        raise RuntimeError("NEXT VARIABLE MISMATCH")
+                    v = store[i] + fstep
+                    store[i] = v
+                    if (fstep > 0 and v <= fend) or (fstep < 0 and v >= fend):
+                        pc = body
+                    else:
+                        for_stack.pop()
+                elif op == IF_FALSE:
+                    if not a():
+                        pc = b
+                elif op == IF_TRUE:
+                    if a():
+                        pc = b
+                elif op == JUMP:
+                    pc = b
+                elif op == FOR:
+                    clock[0] = n
+                    try:
+                        frame = a()
+                    except _Suspend as s:
+                        # a fused loop ran out of time: continue it as plain code
+                        for_stack.extend(s.frames)
+                        pc = s.pc
+                        n = clock[0]
+                        continue
+                    if frame.__class__ is int:
+                        pc = b      # a fused loop already ran to completion
+                        n = clock[0]
+                        continue
+                    # re-entering a loop on the same variable drops it and anything nested in it
+                    for i in range(len(for_stack) - 1, -1, -1):
+                        if for_stack[i][0] == frame[0]:
+                            del for_stack[i:]
+                            break
+                    for_stack.append(frame + (pc,))
+                elif op == GOSUB:
+                    gosub_stack.append(pc)
+                    pc = b
+                elif op == RETURN:
+                    if not gosub_stack:
+                        raise RuntimeError("RETURN WITHOUT GOSUB")
+                    pc = gosub_stack.pop()
+                else:   # END
+                    done = True
+                    break
+        except BaseException:
+            done = True
+            self.failed = max(pc - 1, 0)    # every op moves pc past itself before it can raise
+            raise
+        finally:
+            self.pc = pc
+            self.left = n
+            if done:
+                interp.running = False
+        return not done
+
+    def profile(self, budget, prof):
+        """Like run(), but one statement at a time, charging each to prof.
+
+        Fused loops hand back to plain code after their first pass, so the
+        loop body shows up under its own lines."""
+        prog = self.program
+        if self.kinds is None:
+            self.kinds = [stmt_kind(toks) if toks else 'END' for toks in prog.src]
+        kinds, lines, cost = self.kinds, prog.lines, prog.cost
+        gosub_stack = self.interp.gosub_stack
+        clock = time.perf_counter
+        n = budget if budget is not None else 1 << 62
+        prog.cost = [1] * len(cost)     # so run(1) is exactly one instruction
+        more = True
+        try:
+            while more and n > 0:
+                pc = self.pc
+                stack = tuple(gosub_stack)
+                t = clock()
+                try:
+                    more = self.run(1)
+                    # the rest of the statement: instructions charged nothing
+                    while more and not cost[self.pc]:
+                        more = self.run(1)
+                finally:
+                    if lines[pc] is not None:
+                        prof.add(lines[pc], kinds[pc], clock() - t, stack)
+                n -= cost[pc]
+        finally:
+            prog.cost = cost
+            self.left = n
+        return more